@@ -2,10 +2,10 @@ import os
 import json
 import glob
 from PIL import Image
-import base64
 from openai import OpenAI
 from dotenv import load_dotenv
 import time
+from image_prep import ImagePreparer, image_usage
 
 # 載入環境變數
 load_dotenv()
@@ -19,14 +19,12 @@ QA_AMOUNT = 2
 # 初始化 OpenAI 客戶端
 client = OpenAI(api_key=API_KEY)
 
-
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+# 上傳前依 512px tile 配置縮圖並重新編碼
+image_preparer = ImagePreparer(model='gpt-4o')
 
 
 def query_gpt4(image_path, question):
-    base64_image = encode_image(image_path)
+    prepared = image_preparer.prepare(image_path)
     response = client.chat.completions.create(
         model="gpt-4o",
         messages=[
@@ -34,18 +32,20 @@ def query_gpt4(image_path, question):
                 "role": "user",
                 "content": [
                     {"type": "text", "text": question},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{base64_image}"
-                        }
-                    }
+                    image_preparer.image_content(prepared)
                 ]
             }
         ],
         max_tokens=300
     )
-    return response.choices[0].message.content
+    # 記錄實際上傳的影像 token 數（與原圖相比），用來衡量縮圖省下的費用
+    usage = {
+        "input_tokens": response.usage.prompt_tokens,
+        "output_tokens": response.usage.completion_tokens,
+        "total_tokens": response.usage.total_tokens,
+        **image_usage(prepared)
+    }
+    return response.choices[0].message.content, usage
 
 
 def process_image(image_path, output_folder):
@@ -61,13 +61,14 @@ def process_image(image_path, output_folder):
 
     for question, prefix in questions:
         for i in range(QA_AMOUNT):  # 每個問題生成兩個 JSON 文件
-            result = query_gpt4(image_path, question)
+            result, usage = query_gpt4(image_path, question)
             output_file = os.path.join(
                 image_output_folder, f'{prefix}-{i+1:06d}.json')
             data = {
                 "image_path": image_path,
                 "question": question,
-                "answer": result
+                "answer": result,
+                "token_usage": usage
             }
             with open(output_file, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=4)
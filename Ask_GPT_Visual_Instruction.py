@@ -2,13 +2,13 @@ import os
 import json
 import glob
 from PIL import Image
-import base64
 from openai import OpenAI
 from dotenv import load_dotenv
-import time
 import random
 import uuid
 import tiktoken
+from image_prep import ImagePreparer
+from openai_scheduler import OpenAIScheduler
 
 # 載入環境變數
 load_dotenv()
@@ -24,6 +24,12 @@ ITERATIONS_PER_TYPE = 3  # 每種類型問題重複的次數
 # 初始化 OpenAI 客戶端
 client = OpenAI(api_key=API_KEY)
 
+# 依 x-ratelimit 標頭控制預算，429/5xx 以隨機指數退避重試
+scheduler = OpenAIScheduler(max_concurrency=1, max_retries=MAX_RETRIES)
+
+# 上傳前依 512px tile 配置縮圖並重新編碼
+image_preparer = ImagePreparer(model=MODEL_NAME)
+
 # 初始化 tiktoken 編碼器
 encoding = tiktoken.encoding_for_model(MODEL_NAME)
 
@@ -54,49 +60,33 @@ QUESTIONS = [
 ]
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-
 def count_tokens(text):
     return len(encoding.encode(text))
 
 
 def query_gpt4(image_path, prompt):
-    base64_image = encode_image(image_path)
-    for _ in range(MAX_RETRIES):
-        try:
-            response = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text",
-                                "text": f"{prompt}"},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=500
-            )
-            answer = response.choices[0].message.content
-
-            # 計算tokens
-            input_tokens = count_tokens(prompt)
-            output_tokens = count_tokens(answer)
-
-            return answer, input_tokens, output_tokens
-        except Exception as e:
-            print(f"Error occurred: {e}. Retrying...")
-            time.sleep(5)
-    raise Exception("Max retries reached. Failed to get response from GPT-4.")
+    prepared = image_preparer.prepare(image_path)
+    response, _ = scheduler.call(client, dict(
+        model=MODEL_NAME,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text",
+                        "text": f"{prompt}"},
+                    image_preparer.image_content(prepared)
+                ]
+            }
+        ],
+        max_tokens=500
+    ))
+    answer = response.choices[0].message.content
+
+    # 計算tokens
+    input_tokens = count_tokens(prompt)
+    output_tokens = count_tokens(answer)
+
+    return answer, input_tokens, output_tokens, prepared.tokens
 
 
 def process_image(image_path, output_folder):
@@ -106,6 +96,7 @@ def process_image(image_path, output_folder):
 
     total_input_tokens = 0
     total_output_tokens = 0
+    total_image_tokens = 0
 
     for question_set in QUESTIONS:
         question_type = question_set["question_type"]
@@ -118,7 +109,7 @@ def process_image(image_path, output_folder):
             for question in question_set["questions"]:
                 random_seed = uuid.uuid4().hex
                 modified_question = f"{question}\n\nRandom seed: {random_seed}"
-                answer, input_tokens, output_tokens = query_gpt4(
+                answer, input_tokens, output_tokens, image_tokens = query_gpt4(
                     image_path, modified_question)
                 data["qa_pairs"].append({
                     "question_type": question_type,  # 添加問題類型
@@ -127,6 +118,7 @@ def process_image(image_path, output_folder):
                 })
                 total_input_tokens += input_tokens
                 total_output_tokens += output_tokens
+                total_image_tokens += image_tokens
 
             output_file = os.path.join(
                 image_output_folder, f'{image_name}_{question_type}_{iteration+1}.json')
@@ -140,7 +132,8 @@ def process_image(image_path, output_folder):
         "image_path": image_path,
         "total_input_tokens": total_input_tokens,
         "total_output_tokens": total_output_tokens,
-        "total_tokens": total_input_tokens + total_output_tokens
+        "total_image_tokens": total_image_tokens,
+        "total_tokens": total_input_tokens + total_output_tokens + total_image_tokens
     }
     usage_file = os.path.join(
         image_output_folder, f"{image_name}_token_usage_stats.json")
@@ -2,22 +2,37 @@ import os
 import json
 import glob
 from PIL import Image
-import base64
 from openai import OpenAI
 from dotenv import load_dotenv
 import time
 import random
-import uuid
 import tiktoken
 import requests
-import wikipedia
 from typing import Dict, List, Any, Tuple
+from collections import defaultdict
 import logging
 import regex
 import argparse
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from record_index import RecordIndex
+from wiki_cache import DEFAULT_CACHE_DIR, WikiCache
+from wiki_context import DEFAULT_MAX_TOKENS as WIKI_MAX_TOKENS, WikiContextBuilder
+from image_prep import ImagePreparer, image_usage
+from completion_ledger import CompletionLedger, record_key
+from response_cache import DEFAULT_CACHE_DIR as RESPONSE_CACHE_DIR, ResponseCache, ResponseCacheMiss
+from usage_ledger import UsageLedger, usage_counts
+from openai_scheduler import OpenAIScheduler
+
+# 修改 prompt 時遞增，讓既有 record 視為不同設定而重新生成
+PROMPT_VERSION = 2
 
 class TaiwanLandmarkDatasetGenerator:
-    def __init__(self, base_folder: str = '/media/Pluto/stanley_hsu/TW_attraction/images/TW_Attractions'):
+    def __init__(self, base_folder: str = '/media/Pluto/stanley_hsu/TW_attraction/images/TW_Attractions', cluster_manifest: str = None,
+                 base_url: str = None, wiki_cache_dir: str = DEFAULT_CACHE_DIR, offline_wiki: bool = False,
+                 image_preparer: ImagePreparer = None, response_cache: ResponseCache = None,
+                 wiki_max_tokens: int = WIKI_MAX_TOKENS):
         # Load environment variables
         load_dotenv()
         
@@ -29,13 +44,35 @@ class TaiwanLandmarkDatasetGenerator:
         self.api_key = os.getenv('SELF_OPENAI_API_KEY_2')
         self.max_retries = 10
         
+        # 上傳前依 512px tile 配置縮圖並重新編碼，結果依內容雜湊快取
+        self.image_preparer = image_preparer or ImagePreparer(model=self.better_model_name)
+        
+        # 維基百科內容從本地快取讀取，可先用 wiki_cache.py 預先抓取以離線執行
+        self.wiki_cache = WikiCache(wiki_cache_dir, offline=offline_wiki)
+        
+        # 近似重複圖片群組（image_dedup.py 產生），只對每群的代表圖片呼叫 API
+        self.cluster_representatives = self.load_cluster_representatives(cluster_manifest)
+        
         # Initialize OpenAI client
-        self.client = OpenAI(api_key=self.api_key)
+        # base_url 可指向相容的本地伺服器（測試用）
+        self.base_url = base_url
+        self.client = OpenAI(api_key=self.api_key, base_url=base_url)
+        
+        # 依 x-ratelimit 標頭控制請求與 token 預算，429/5xx 以隨機退避重試 max_retries 次
+        self.scheduler = OpenAIScheduler(max_concurrency=1, max_retries=self.max_retries)
+        
+        # 相同請求（模型、訊息、圖片、取樣參數）直接使用快取的回應，None 則不快取
+        self.response_cache = response_cache
         
         # Initialize tokenizer
         self.tokenizer_mini = tiktoken.encoding_for_model(self.model_name)
         self.tokenizer_better = tiktoken.encoding_for_model(self.better_model_name)
         
+        # 對話請求只放入與圖片描述最相關的維基百科段落，None 則放入全文
+        self.wiki_max_tokens = wiki_max_tokens
+        self.wiki_context = WikiContextBuilder(lambda text: self.count_tokens(text, self.model_name),
+                                               max_tokens=wiki_max_tokens)
+        
         # Setup logging
         logging.basicConfig(
             level=logging.INFO,
@@ -49,6 +86,47 @@ class TaiwanLandmarkDatasetGenerator:
         
         # Create output directory if it doesn't exist
         os.makedirs(self.output_folder, exist_ok=True)
+        
+        # (景點, 圖片) → record 的索引，image_data_json_filter 用它做集合交集
+        self.record_index = RecordIndex(self.output_folder)
+        # 舊版本寫入、不在索引中的 record 也要納入，新 record 才能取代它們
+        self.record_index.refresh()
+        
+        # 已完成圖片的紀錄，重跑時跳過；record 依圖片內容與生成設定命名
+        self.ledger = CompletionLedger(self.output_folder)
+        
+        # 每個請求的 API 回報用量（SQLite），Count_Price 直接彙總
+        self.usage_ledger = UsageLedger(self.output_folder)
+        self.record_keys = {}
+        # 每張圖片由回應快取重播的請求數，計算實際 API 呼叫數時扣除
+        self.replayed_calls = defaultdict(int)
+
+    def load_cluster_representatives(self, cluster_manifest: str = None) -> Dict[str, set]:
+        """Load the representative images of each landmark from a cluster manifest."""
+        if not cluster_manifest:
+            return {}
+        with open(cluster_manifest, 'r', encoding='utf-8') as f:
+            clusters = json.load(f)['clusters']
+        return {
+            landmark: {os.path.basename(path) for cluster in landmark_clusters for path in cluster['representatives']}
+            for landmark, landmark_clusters in clusters.items()
+        }
+
+    def generator_config(self, landmark_name: str) -> Dict:
+        """Settings that determine a record besides the image content."""
+        return {
+            'landmark_name': landmark_name,
+            'description_model': self.better_model_name,
+            'conversation_model': self.model_name,
+            'prompt_version': PROMPT_VERSION,
+            'wiki_max_tokens': self.wiki_max_tokens
+        }
+
+    def record_key(self, image_path: str, landmark_name: str) -> str:
+        """Content-addressed key of the record of an image (memoized per run)."""
+        if image_path not in self.record_keys:
+            self.record_keys[image_path] = record_key(image_path, self.generator_config(landmark_name))
+        return self.record_keys[image_path]
 
     def count_tokens(self, text: str, model: str) -> int:
         """Count tokens for a given text using the appropriate tokenizer."""
@@ -56,54 +134,108 @@ class TaiwanLandmarkDatasetGenerator:
         return len(tokenizer.encode(text))
 
     def encode_image(self, image_path: str) -> str:
-        """Encode image to base64 string."""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        """Encode the resized upload version of an image to base64 string."""
+        return self.image_preparer.prepare(image_path).b64
 
     def get_wiki_content(self, landmark_name: str) -> str:
-        """Fetch content from Wikipedia in Traditional Chinese."""
-        wikipedia.set_lang("zh-tw")
-        try:
-            page = wikipedia.page(landmark_name)
-            return page.content
-        except Exception as e:
-            self.logger.error(f"Error fetching Wikipedia content for {landmark_name}: {e}")
-            return ""
+        """Fetch content from Wikipedia in Traditional Chinese (served from the local wiki cache)."""
+        entry = self.wiki_cache.entry(landmark_name)
+        if entry['error']:
+            self.logger.error(f"Error fetching Wikipedia content for {landmark_name}: {entry['error']}")
+        return entry['content']
+
+    def token_usage(self, input_tokens: int, output_content: str, model: str, image_tokens: Dict = None,
+                    response_usage=None, context_tokens: Dict = None, batch: bool = False) -> Dict:
+        """Token accounting of one call.
+
+        With ``response_usage`` (the API-reported usage, a response's ``usage`` or the
+        ``usage`` of a Batch API result) the billed prompt tokens, which include the
+        image tokens, and completion tokens are used as is, plus the prompt tokens
+        served from the provider's prompt cache. Without it ``input_tokens`` (counted
+        from the prompt text) is used and the output is counted with tiktoken.
+        ``image_tokens`` (from ``build_description_request``) adds the computed image
+        token count of the uploaded image and of the original file, ``context_tokens``
+        (from ``build_conversation_requests``) the tokens of the whole Wikipedia article,
+        of the selected context and the input the call would have had with the whole
+        article. ``batch`` marks calls sent through the Batch API, which are billed at a
+        discount.
+        """
+        if response_usage is not None:
+            counts = usage_counts(response_usage)
+            input_tokens = counts["prompt_tokens"]
+            output_tokens = counts["completion_tokens"]
+        else:
+            output_tokens = self.count_tokens(output_content, model)
+        usage = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        }
+        if image_tokens:
+            usage.update(image_tokens)
+        if context_tokens:
+            usage.update(context_tokens)
+        if response_usage is not None:
+            usage["prompt_tokens"] = counts["prompt_tokens"]
+            usage["cached_tokens"] = counts["cached_tokens"]
+        if batch:
+            usage["batch"] = True
+        return usage
+
+    def chat_completion(self, request: Dict, image_path: str, kind: str):
+        """
+        Send a chat-completions request, served from the response cache when one is
+        configured, and append its usage to the usage ledger.
+        """
+        response = self.response_cache.lookup(request) if self.response_cache is not None else None
+        replayed = response is not None
+        if replayed:
+            self.replayed_calls[image_path] += 1
+        latency = 0
+        if response is None:
+            response, latency = self.scheduler.call(self.client, request)
+            if self.response_cache is not None:
+                self.response_cache.put(request, response)
+        self.usage_ledger.record(request['model'], response.usage, image_path, kind,
+                                 latency=latency, replayed=replayed)
+        return response
+
+    def build_description_request(self, image_path: str, landmark_name: str) -> Tuple[Dict, int, Dict]:
+        """組出初始描述的 API 請求參數，並回傳輸入token數與圖片token數"""
+        image = self.image_preparer.prepare(image_path)
+        
+        system_prompt = "你是一個專業的圖像描述與台灣景點專家。請使用繁體中文，詳細描述圖片中的景點，包含其特色、建築風格、周圍環境等細節。請使用結構化的方式描述。給的景點資訊可能會出錯，請以圖片為主，有錯誤請指出。"
+        user_prompt = f"這張圖片可能是台灣的{landmark_name}。請詳細描述圖片中的細節，並確認這是否確實為{landmark_name}。如果不是，請指出實際的景點名稱。"
+        
+        # 記錄輸入token
+        input_tokens = self.count_tokens(system_prompt + user_prompt, self.better_model_name)
+        
+        request = dict(
+            model=self.better_model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": [
+                    {"type": "text", "text": user_prompt},
+                    self.image_preparer.image_content(image)
+                ]}
+            ],
+            max_tokens=1000
+        )
+        return request, input_tokens, image_usage(image)
 
     def generate_initial_description(self, image_path: str, landmark_name: str) -> Tuple[str, Dict]:
         """生成初始描述並追蹤token使用量"""
         try:
-            base64_image = self.encode_image(image_path)
+            request, input_tokens, image_tokens = self.build_description_request(image_path, landmark_name)
             
-            system_prompt = "你是一個專業的圖像描述與台灣景點專家。請使用繁體中文，詳細描述圖片中的景點，包含其特色、建築風格、周圍環境等細節。請使用結構化的方式描述。給的景點資訊可能會出錯，請以圖片為主，有錯誤請指出。"
-            user_prompt = f"這張圖片可能是台灣的{landmark_name}。請詳細描述圖片中的細節，並確認這是否確實為{landmark_name}。如果不是，請指出實際的景點名稱。"
-            
-            # 記錄輸入token
-            input_tokens = self.count_tokens(system_prompt + user_prompt, self.better_model_name)
-            
-            response = self.client.chat.completions.create(
-                model=self.better_model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": user_prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                    ]}
-                ],
-                max_tokens=1000
-            )
+            response = self.chat_completion(request, image_path, 'description')
             
             output_content = response.choices[0].message.content
-            output_tokens = self.count_tokens(output_content, self.better_model_name)
-            
-            tokens = {
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-                "total_tokens": input_tokens + output_tokens
-            }
-            
-            return output_content, tokens
+            return output_content, self.token_usage(input_tokens, output_content, self.better_model_name, image_tokens,
+                                                    response.usage)
             
+        except ResponseCacheMiss:
+            raise
         except Exception as e:
             self.logger.error(f"Error generating initial description: {e}")
             return "", {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
@@ -117,10 +249,20 @@ class TaiwanLandmarkDatasetGenerator:
         else:
             return ""
     
-    def generate_conversations(self, image_path: str, description: str, wiki_content: str) -> Dict:
-        """Generate various types of conversations using GPT-4o-mini."""
-        prompt_templates = {
-    "multi_turn": """你是一個臺灣人，正在生成一段內容簡短的對話，在生成對話時，請保持對話的一貫性，並且讓對話自然且有意義。整段對話必須是使用繁體中文以及臺灣人的用語習慣，不能有任何其他語言，請根據以下資訊，生成多組自然的多輪對話。
+    def build_conversation_requests(self, description: str, wiki_content: str) -> Dict[str, Tuple[Dict, int, Dict]]:
+        """
+        Build the API request, input token count and wiki context token counts of every
+        conversation type.
+
+        Messages are ordered from the most to the least shared content: the system
+        message, the landmark's Wikipedia context, the image description (same for
+        every conversation type) and finally the type-specific task, so the provider's
+        prompt cache can reuse the longest possible prefix. The Wikipedia context is
+        the whole article (same for every image of the landmark) when it fits
+        ``wiki_max_tokens``, otherwise the passages most relevant to the description.
+        """
+        task_prompts = {
+    "multi_turn": """你是一個臺灣人，正在生成一段內容簡短的對話，在生成對話時，請保持對話的一貫性，並且讓對話自然且有意義。整段對話必須是使用繁體中文以及臺灣人的用語習慣，不能有任何其他語言，請根據前面提供的維基百科內容與圖片描述，生成多組自然的多輪對話。
 
 思考步驟：
 1. 場景分析：
@@ -138,25 +280,19 @@ class TaiwanLandmarkDatasetGenerator:
    - 融入維基百科的歷史和文化背景
    - 加入在地特色和趣聞軼事
 
-圖片描述：
-{description}
-
-維基百科內容：
-{wiki_content}
-
 請生成四組不同情境的對話，每組至少五輪，每一輪對話的回答需要足夠豐富且詳細，符合以下JSON格式：
-{{
+{
     "qa_pairs": [
-        {{
+        {
             "conversation": [
-                {{"role": "user", "content": "<使用者問題>"}},
-                {{"role": "assistant", "content": "<助理回答>"}},
+                {"role": "user", "content": "<使用者問題>"},
+                {"role": "assistant", "content": "<助理回答>"},
                 // 更多對話輪次...
             ]
-        }},
+        },
         // 更多樣化的對話...
     ]
-}}
+}
 
 要求：
 1. 對話要自然流暢，避免生硬的問答
@@ -166,7 +302,7 @@ class TaiwanLandmarkDatasetGenerator:
 5. 使用繁體中文，口語要自然親切
 6. 只輸出符合要求的JSON格式""",
 
-    "detailed_info": """你是一個專業的文史研究員，請根據提供的資訊，生成關於這個景點的深入分析對話。
+    "detailed_info": """你是一個專業的文史研究員，請根據前面提供的維基百科內容與圖片描述，生成關於這個景點的深入分析對話。
 
 思考步驟：
 1. 景點辨識：
@@ -185,52 +321,46 @@ class TaiwanLandmarkDatasetGenerator:
    - 設計循序漸進的問答結構
    - 加入適當的解釋和舉例
 
-圖片描述：
-{description}
-
-維基百科內容：
-{wiki_content}
-
 請生成以下JSON格式的深入分析對話，請使用繁體中文，如果維基百科內容或圖片沒有對應的資料且無法推測，請生成「我很抱歉，我還不清楚這部分的資訊」：
-{{
+{
     "qa_pairs": [
-        {{
+        {
             "question_type": "basic_info",
             "question": "這個景點的基本資訊是什麼？包含位置、建立時間等。",
             "answer": "<回答此問題的思考過程並給出包涵整理基本資訊回答>"
-        }},
-        {{
+        },
+        {
             "question_type": "architectural_features",
             "question": "從建築特色來看，這個景點有什麼獨特之處？",
             "answer": "<回答此問題的思考過程並給出包涵整理基本資訊回答>"
-        }},
-        {{
+        },
+        {
             "question_type": "historical_significance",
             "question": "這個景點在歷史上有什麼重要意義？",
             "answer": "<回答此問題的思考過程並給出歷史意義回答>"
-        }},
-        {{
+        },
+        {
             "question_type": "cultural_impact",
             "question": "這個景點對當地文化有什麼影響？",
             "answer": "<回答此問題的思考過程並給出文化影響回答>"
-        }},
-        {{
+        },
+        {
             "question_type": "current_status",
             "question": "目前這個景點的保存狀況和使用情況如何？",
             "answer": "<回答此問題的思考過程並給出現況描述回答>"
-        }},
-        {{
+        },
+        {
             "question_type": "visual_features",
             "question": "從圖片中可以觀察到哪些特別的元素？",
             "answer": "<回答此問題的思考過程並給出圖片特徵分析回答>"
-        }},
-        {{
+        },
+        {
             "question_type": "tourist_information",
             "question": "對想要參觀這個景點的遊客，有什麼特別的建議？",
             "answer": "<回答此問題的思考過程並給出旅遊建議回答>"
-        }}
+        }
     ]
-}}
+}
 
 要求：
 1. 每個回答都要包含具體且詳實的資訊
@@ -243,46 +373,61 @@ class TaiwanLandmarkDatasetGenerator:
 8. 只輸出符合要求的JSON格式"""
 }
 
+        conversation_requests = {}
+        system_message = "你是一個專業的導遊兼歷史學家，擅長介紹台灣的景點。"
+        # 只保留與圖片描述最相關的維基百科段落，控制在 token 預算內
+        wiki_context, context_tokens = self.wiki_context.build(wiki_content, description)
+        wiki_message = f"維基百科內容：\n{wiki_context}"
+        description_message = f"圖片描述：\n{description}"
+        for conv_type, task_prompt in task_prompts.items():
+            input_text = system_message + wiki_message + description_message + task_prompt
+            
+            # 記錄輸入token
+            input_tokens = self.count_tokens(input_text, self.model_name)
+            context_usage = dict(context_tokens, full_wiki_input_tokens=input_tokens + context_tokens['wiki_tokens']
+                                 - context_tokens['wiki_context_tokens'])
+            
+            conversation_requests[conv_type] = (dict(
+                model=self.model_name,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": system_message
+                    },
+                    {
+                        "role": "user",
+                        "content": wiki_message
+                    },
+                    {
+                        "role": "user",
+                        "content": description_message
+                    },
+                    {
+                        "role": "user",
+                        "content": task_prompt
+                    }
+                ],
+                temperature=0.7
+            ), input_tokens, context_usage)
+        return conversation_requests
+
+    def generate_conversations(self, image_path: str, description: str, wiki_content: str) -> Dict:
+        """Generate various types of conversations using GPT-4o-mini."""
         results = {}
         token_usage = {}
         
-        for conv_type, prompt in prompt_templates.items():
+        for conv_type, (request, input_tokens, context_tokens) in self.build_conversation_requests(
+                description, wiki_content).items():
             try:
-                system_message = "你是一個專業的導遊兼歷史學家，擅長介紹台灣的景點。"
-                formatted_prompt = prompt.format(
-                    description=description,
-                    wiki_content=wiki_content
-                )
-                input_text = system_message + formatted_prompt
-                
-                # 記錄輸入token
-                input_tokens = self.count_tokens(input_text, self.model_name)
-                
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": system_message
-                        },
-                        {
-                            "role": "user",
-                            "content": formatted_prompt
-                        }
-                    ],
-                    temperature=0.7
-                )
+                response = self.chat_completion(request, image_path, conv_type)
                 
                 output_content = response.choices[0].message.content
-                output_tokens = self.count_tokens(output_content, self.model_name)
                 results[conv_type] = json.loads(self.extract_json(output_content))
+                token_usage[conv_type] = self.token_usage(input_tokens, output_content, self.model_name,
+                                                          response_usage=response.usage, context_tokens=context_tokens)
                 
-                token_usage[conv_type] = {
-                    "input_tokens": input_tokens,
-                    "output_tokens": output_tokens,
-                    "total_tokens": input_tokens + output_tokens
-                }
-                
+            except ResponseCacheMiss:
+                raise
             except Exception as e:
                 self.logger.error(f"Error generating {conv_type} conversation: {e}\n")
                 # if output_content:
@@ -317,24 +462,32 @@ class TaiwanLandmarkDatasetGenerator:
             self.logger.error(f"Error evaluating content: {e}")
             return False
 
-    def save_dataset(self, landmark_name: str, data: Dict):
-        """Save generated dataset to JSON file."""
+    def save_dataset(self, landmark_name: str, data: Dict) -> str:
+        """Save generated dataset to JSON file named by the record key; returns its path."""
         # 創建landmark特定的目錄路徑
         landmark_dir = os.path.join(self.output_folder, landmark_name)
         os.makedirs(landmark_dir, exist_ok=True)
         
+        # 同一張圖片、同樣設定重跑時覆寫同一個檔案，不會產生重複 record
+        key = self.record_key(os.path.join(data['base_folder'], landmark_name, data['image_path']), landmark_name)
         output_path = os.path.join(
             landmark_dir,
-            f"{landmark_name}_{uuid.uuid4().hex[:8]}.json"
+            f"{landmark_name}_{key}.json"
         )
         
         try:
             # 確保目錄存在
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
             
-            with open(output_path, 'w', encoding='utf-8') as f:
+            with open(f"{output_path}.part", 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(f"{output_path}.part", output_path)
+            # 同一張圖片在舊設定（例如舊的 PROMPT_VERSION）下的 record 由新的取代
+            stale = self.record_index.supersede(output_path, landmark_name, data.get('image_path', ''))
             self.logger.info(f"Dataset saved to {output_path}")
+            if stale:
+                self.logger.info(f"Removed {len(stale)} superseded records of {data.get('image_path', '')}: {', '.join(stale)}")
+            return output_path
         except Exception as e:
             self.logger.error(f"Error saving dataset: {e}")
             raise  # 重新拋出異常以便追蹤問題
@@ -348,11 +501,20 @@ class TaiwanLandmarkDatasetGenerator:
         # 生成初始描述
         description, description_tokens = self.generate_initial_description(image_path, landmark_name)
         if not description:
+            self.mark_failed(base_folder, image, landmark_name, calls=1, error="no description")
             return
         
         # 生成對話
         conversations, conversation_tokens = self.generate_conversations(image_path, description, landmark_info)
         
+        self.save_record(base_folder, image, landmark_name, description, description_tokens,
+                         conversations, conversation_tokens)
+
+    def save_record(self, base_folder: str, image: str, landmark_name: str, description: str,
+                    description_tokens: Dict, conversations: Dict, conversation_tokens: Dict):
+        """組合輸出資料與token使用量，有有效對話時存檔"""
+        image_path = os.path.join(base_folder, landmark_name, image)
+        
         # 計算總token使用量
         total_tokens = {
             "input_tokens": description_tokens["input_tokens"] + 
@@ -383,9 +545,15 @@ class TaiwanLandmarkDatasetGenerator:
             }
         }
         
+        # API 回報的提示快取命中量（批次或舊的回應沒有這些欄位）
+        usages = [description_tokens, *conversation_tokens.values()]
+        prompt_tokens = sum(usage.get("prompt_tokens", 0) for usage in usages)
+        cached_tokens = sum(usage.get("cached_tokens", 0) for usage in usages)
+        
         # 如果包含有效對話就保存數據集
+        record = None
         if filtered_data['conversations']:
-            self.save_dataset(landmark_name, filtered_data)
+            record = os.path.relpath(self.save_dataset(landmark_name, filtered_data), self.output_folder)
             
             # 記錄token使用情況到日誌
             self.logger.info(f"""
@@ -393,19 +561,58 @@ Token usage for image {os.path.basename(image_path)}:
 Description ({self.better_model_name}): {description_tokens['total_tokens']} tokens
 Conversations ({self.model_name}): {sum(usage['total_tokens'] for usage in conversation_tokens.values())} tokens
 Total: {total_tokens['total_tokens']} tokens
+Cached prompt tokens: {cached_tokens}/{prompt_tokens}
 """)
+        
+        # 有任何對話類型失敗就視為未完成，下次重跑整張圖片
+        failed_types = [conv_type for conv_type, result in conversations.items() if result is None]
+        status = 'done' if record and not failed_types else 'failed'
+        error = f"failed conversation types: {', '.join(failed_types)}" if failed_types else None
+        # 回應快取重播的請求不算 API 呼叫
+        calls = 1 + len(conversations) - self.replayed_calls.pop(image_path, 0)
+        self.ledger.mark(self.record_key(image_path, landmark_name), landmark_name, image, status,
+                         calls=calls, record=record, error=error)
+
+    def mark_failed(self, base_folder: str, image: str, landmark_name: str, calls: int, error: str):
+        """Record an image whose generation failed before a record could be written."""
+        image_path = os.path.join(base_folder, landmark_name, image)
+        self.ledger.mark(self.record_key(image_path, landmark_name), landmark_name, image, 'failed',
+                         calls=calls - self.replayed_calls.pop(image_path, 0), error=error)
+
+    def list_images(self, landmark_name: str) -> List[str]:
+        """List the images of a landmark, keeping only cluster representatives when a cluster manifest is given."""
+        landmark_path = os.path.join(self.base_folder, landmark_name)
+        images = os.listdir(landmark_path)
+        if landmark_name in self.cluster_representatives:
+            representatives = self.cluster_representatives[landmark_name]
+            kept = [image for image in images if image in representatives]
+            self.logger.info(f"Skipping {len(images) - len(kept)} images of {landmark_name} that are not cluster representatives")
+            images = kept
+        return images
+
+    def pending_images(self, landmark_name: str) -> List[str]:
+        """Images of a landmark without a finished record for the current generator config."""
+        images = self.list_images(landmark_name)
+        keys = {image: self.record_key(os.path.join(self.base_folder, landmark_name, image), landmark_name)
+                for image in images}
+        finished = [image for image in images if self.ledger.is_done(keys[image])]
+        if finished:
+            calls_avoided = self.ledger.record_run(keys[image] for image in finished)
+            self.logger.info(f"Skipping {len(finished)} finished images of {landmark_name} "
+                             f"({calls_avoided} API calls avoided, {self.ledger.calls_avoided} in total)")
+        return [image for image in images if not self.ledger.is_done(keys[image])]
 
     def generate_dataset(self, landmark_name: str):
         """Generate dataset for all landmarks in the input folder."""
         print(f'self.base folder: {self.base_folder}')
         self.logger.info(f"Processing {landmark_name}")
         landmark_info = self.get_wiki_content(landmark_name)
-        landmark_path = os.path.join(self.base_folder, landmark_name)
-        for image in os.listdir(landmark_path):
+        for image in self.pending_images(landmark_name):
             self.process_landmark(self.base_folder, image, landmark_name, landmark_info)
+        self.logger.info(f"API scheduler: {self.scheduler.metrics()}")
 
-def main():
-    parser = argparse.ArgumentParser(description='Generate dataset for Taiwan landmarks.')
+def add_generator_arguments(parser: argparse.ArgumentParser):
+    """Arguments shared by the serial, async and batch generators."""
     parser.add_argument('--base-folder', 
                        type=str, 
                        default='/media/Pluto/stanley_hsu/TW_attraction/images/TW_Attractions',
@@ -413,9 +620,76 @@ def main():
     parser.add_argument('--landmark', 
                        type=str,
                        help='Specific landmark folder to process (optional). If not provided, will process all landmarks.')
+    parser.add_argument('--cluster-manifest',
+                       type=str,
+                       default=None,
+                       help='image_clusters.json from image_dedup.py; only cluster representatives are processed')
+    parser.add_argument('--wiki-cache-dir',
+                       type=str,
+                       default=DEFAULT_CACHE_DIR,
+                       help='Local Wikipedia cache (prefetch with wiki_cache.py)')
+    parser.add_argument('--offline-wiki',
+                       action='store_true',
+                       help='Never fetch Wikipedia; pages missing from the cache are treated as empty')
+    parser.add_argument('--wiki-max-tokens',
+                       type=int,
+                       default=WIKI_MAX_TOKENS,
+                       help='Token budget of the Wikipedia context of a conversation request (0 sends the whole article)')
+    parser.add_argument('--image-detail',
+                       type=str,
+                       choices=['high', 'low'],
+                       default='high',
+                       help='Detail level of uploaded images')
+    parser.add_argument('--image-min-side',
+                       type=int,
+                       default=512,
+                       help='Shortest side kept when resizing uploads to the fewest 512px tiles')
+    parser.add_argument('--image-quality',
+                       type=int,
+                       default=85,
+                       help='JPEG quality of uploaded images')
+    parser.add_argument('--response-cache',
+                       action='store_true',
+                       help='Serve repeated API requests from the local response cache')
+    parser.add_argument('--response-cache-dir',
+                       type=str,
+                       default=RESPONSE_CACHE_DIR,
+                       help='Directory of the response cache')
+    parser.add_argument('--response-cache-size',
+                       type=int,
+                       default=1024,
+                       help='Size limit of the response cache in MB (least recently used responses are evicted)')
+    parser.add_argument('--replay-only',
+                       action='store_true',
+                       help='Only replay cached responses and fail on a cache miss (implies --response-cache)')
+    parser.add_argument('--base-url',
+                       type=str,
+                       default=None,
+                       help='OpenAI-compatible API base URL (e.g. a local fake server for testing)')
+
+def generator_kwargs(args) -> Dict[str, Any]:
+    """Constructor arguments of a generator from the parsed ``add_generator_arguments`` options."""
+    return dict(
+        base_folder=args.base_folder,
+        cluster_manifest=args.cluster_manifest,
+        base_url=args.base_url,
+        wiki_cache_dir=args.wiki_cache_dir,
+        offline_wiki=args.offline_wiki,
+        wiki_max_tokens=args.wiki_max_tokens or None,
+        image_preparer=ImagePreparer(min_short_side=args.image_min_side,
+                                     quality=args.image_quality,
+                                     detail=args.image_detail),
+        response_cache=ResponseCache(args.response_cache_dir,
+                                     max_bytes=args.response_cache_size * 1024 * 1024,
+                                     replay_only=args.replay_only) if args.response_cache or args.replay_only else None
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate dataset for Taiwan landmarks.')
+    add_generator_arguments(parser)
     args = parser.parse_args()
 
-    generator = TaiwanLandmarkDatasetGenerator(base_folder=args.base_folder)
+    generator = TaiwanLandmarkDatasetGenerator(**generator_kwargs(args))
     generator.generate_dataset(args.landmark)
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+import os
+import json
+import asyncio
+import argparse
+from typing import Dict, List, Tuple
+from openai import AsyncOpenAI
+from Ask_GPT_4o_mini import TaiwanLandmarkDatasetGenerator, add_generator_arguments, generator_kwargs
+from response_cache import ResponseCacheMiss
+from openai_scheduler import OpenAIScheduler
+
+
+class AsyncTaiwanLandmarkDatasetGenerator(TaiwanLandmarkDatasetGenerator):
+    """
+    Concurrent version of TaiwanLandmarkDatasetGenerator.
+
+    Images are processed concurrently and the conversation types of an image are
+    requested in parallel once its description is ready. ``concurrency`` bounds the
+    number of API requests in flight across all images; within it the scheduler adapts
+    the concurrency to the provider's rate limits. Prompts, output files and token
+    accounting are those of the serial generator.
+    """
+
+    def __init__(self, *args, concurrency: int = 16, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.concurrency = concurrency
+        self.async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+        self.scheduler = OpenAIScheduler(max_concurrency=concurrency, max_retries=self.max_retries)
+
+    async def create_completion(self, request: Dict, image_path: str, kind: str):
+        # 快取命中不佔用並行名額
+        if self.response_cache is not None:
+            response = self.response_cache.lookup(request)
+            if response is not None:
+                self.replayed_calls[image_path] += 1
+                self.usage_ledger.record(request['model'], response.usage, image_path, kind, latency=0, replayed=True)
+                return response
+        # 延遲只計算成功的那次請求，不含等待並行名額與預算的時間
+        response, latency = await self.scheduler.acall(self.async_client, request)
+        if self.response_cache is not None:
+            self.response_cache.put(request, response)
+        self.usage_ledger.record(request['model'], response.usage, image_path, kind, latency=latency)
+        return response
+
+    async def generate_initial_description_async(self, image_path: str, landmark_name: str) -> Tuple[str, Dict]:
+        """生成初始描述並追蹤token使用量"""
+        try:
+            request, input_tokens, image_tokens = await asyncio.to_thread(
+                self.build_description_request, image_path, landmark_name)
+            response = await self.create_completion(request, image_path, 'description')
+            output_content = response.choices[0].message.content
+            return output_content, self.token_usage(input_tokens, output_content, self.better_model_name, image_tokens,
+                                                    response.usage)
+        except ResponseCacheMiss:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error generating initial description: {e}")
+            return "", {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+
+    async def generate_conversation_async(self, image_path: str, conv_type: str, request: Dict, input_tokens: int,
+                                          context_tokens: Dict):
+        try:
+            response = await self.create_completion(request, image_path, conv_type)
+            output_content = response.choices[0].message.content
+            return json.loads(self.extract_json(output_content)), \
+                self.token_usage(input_tokens, output_content, self.model_name, response_usage=response.usage,
+                                 context_tokens=context_tokens)
+        except ResponseCacheMiss:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error generating {conv_type} conversation: {e}\n")
+            return None, None
+
+    async def generate_conversations_async(self, image_path: str, description: str, wiki_content: str) -> Tuple[Dict, Dict]:
+        """同時送出各種對話類型的請求"""
+        # token 計數與維基段落選取都是 CPU 工作，放到執行緒中避免卡住其他進行中的請求
+        conversation_requests = await asyncio.to_thread(self.build_conversation_requests, description, wiki_content)
+        outputs = await asyncio.gather(*(
+            self.generate_conversation_async(image_path, conv_type, request, input_tokens, context_tokens)
+            for conv_type, (request, input_tokens, context_tokens) in conversation_requests.items()
+        ))
+
+        results = {}
+        token_usage = {}
+        for conv_type, (result, usage) in zip(conversation_requests, outputs):
+            results[conv_type] = result
+            if usage is not None:
+                token_usage[conv_type] = usage
+        return results, token_usage
+
+    async def process_landmark_async(self, base_folder: str, image: str, landmark_name: str, landmark_info: str):
+        """處理單個景點圖片，並追蹤所有token使用量"""
+        image_path = os.path.join(base_folder, landmark_name, image)
+
+        # 生成初始描述
+        description, description_tokens = await self.generate_initial_description_async(image_path, landmark_name)
+        if not description:
+            self.mark_failed(base_folder, image, landmark_name, calls=1, error="no description")
+            return
+
+        # 生成對話
+        conversations, conversation_tokens = await self.generate_conversations_async(
+            image_path, description, landmark_info)
+
+        self.save_record(base_folder, image, landmark_name, description, description_tokens,
+                         conversations, conversation_tokens)
+
+    async def generate_dataset_async(self, landmark_names: List[str]):
+        """Generate the dataset of the given landmarks with all images processed concurrently."""
+        # 同時處理的圖片數與請求數同一量級，避免一次把所有圖片讀進記憶體
+        image_slots = asyncio.Semaphore(self.concurrency)
+
+        async def process(image, landmark_name, landmark_info):
+            async with image_slots:
+                try:
+                    await self.process_landmark_async(self.base_folder, image, landmark_name, landmark_info)
+                except ResponseCacheMiss:
+                    raise
+                except Exception as e:
+                    self.logger.error(f"Error processing {landmark_name}/{image}: {e}")
+
+        if not self.wiki_cache.offline:
+            # 尚未快取的維基百科頁面先一次並行抓取
+            await asyncio.to_thread(self.wiki_cache.prefetch, landmark_names)
+
+        tasks = []
+        for landmark_name in landmark_names:
+            self.logger.info(f"Processing {landmark_name}")
+            landmark_info = await asyncio.to_thread(self.get_wiki_content, landmark_name)
+            tasks.extend(process(image, landmark_name, landmark_info) for image in self.pending_images(landmark_name))
+        await asyncio.gather(*tasks)
+        self.logger.info(f"API scheduler: {self.scheduler.metrics()}")
+
+    def generate_dataset(self, landmark_name: str):
+        """Generate dataset for all landmarks in the input folder."""
+        landmark_names = [landmark_name] if landmark_name else sorted(
+            name for name in os.listdir(self.base_folder) if os.path.isdir(os.path.join(self.base_folder, name)))
+        asyncio.run(self.generate_dataset_async(landmark_names))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate dataset for Taiwan landmarks with concurrent API requests.')
+    add_generator_arguments(parser)
+    parser.add_argument('--concurrency',
+                       type=int,
+                       default=16,
+                       help='Maximum number of API requests in flight')
+    args = parser.parse_args()
+
+    generator = AsyncTaiwanLandmarkDatasetGenerator(**generator_kwargs(args),
+                                                    concurrency=args.concurrency)
+    generator.generate_dataset(args.landmark)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import argparse
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Tuple
+from Ask_GPT_4o_mini import TaiwanLandmarkDatasetGenerator, add_generator_arguments, generator_kwargs
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+# Batch API 單一輸入檔的上限（請求數與檔案大小），保留一些餘裕
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchTaiwanLandmarkDatasetGenerator(TaiwanLandmarkDatasetGenerator):
+    """
+    Batch API version of TaiwanLandmarkDatasetGenerator.
+
+    The description requests of every image are written to Batch API JSONL files,
+    submitted and polled; the results are joined back by ``custom_id``. A second
+    batch then carries the conversation requests of every described image, and the
+    records are written in the usual format with the usual token accounting.
+    Each stage keeps its input files, batch ids and downloaded outputs in
+    ``batch_dir`` so an interrupted run resumes polling instead of resubmitting.
+    """
+
+    def __init__(self, *args, batch_dir: str = 'batches', poll_interval: float = 60, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_dir = batch_dir
+        self.poll_interval = poll_interval
+        os.makedirs(self.batch_dir, exist_ok=True)
+
+    def write_batch_files(self, stage: str, requests: Iterable[Tuple[str, Dict, Dict]]) -> Tuple[List[str], Dict[str, Dict]]:
+        """
+        Serialize ``(custom_id, request, accounting)`` into one or more Batch API input files.
+        ``accounting`` holds the ``token_usage`` arguments known before the call (input and
+        image tokens). Returns the file paths and the accounting of every request.
+        """
+        paths = []
+        accounting = {}
+        f = None
+        count = size = 0
+        for custom_id, request, request_accounting in requests:
+            accounting[custom_id] = request_accounting
+            line = json.dumps({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': BATCH_ENDPOINT,
+                'body': request
+            }, ensure_ascii=False) + '\n'
+            line_size = len(line.encode('utf-8'))
+            if f is None or count >= MAX_BATCH_REQUESTS or size + line_size > MAX_BATCH_BYTES:
+                if f is not None:
+                    f.close()
+                paths.append(os.path.join(self.batch_dir, f"{stage}_{len(paths)}.jsonl"))
+                f = open(paths[-1], 'w', encoding='utf-8')
+                count = size = 0
+            f.write(line)
+            count += 1
+            size += line_size
+        if f is not None:
+            f.close()
+        return paths, accounting
+
+    def submit_batch(self, input_path: str) -> str:
+        with open(input_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window='24h'
+        )
+        self.logger.info(f"Submitted batch {batch.id} for {input_path}")
+        return batch.id
+
+    def wait_for_batch(self, batch_id: str):
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in FINAL_STATUSES:
+                return batch
+            counts = batch.request_counts
+            if counts is not None:
+                self.logger.info(f"Batch {batch_id} {batch.status}: {counts.completed}/{counts.total} completed")
+            time.sleep(self.poll_interval)
+
+    def read_batch_output(self, text: str) -> Dict[str, Tuple[str, Dict]]:
+        """Map ``custom_id`` to the message content and usage of every successful response."""
+        results = {}
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get('response') or {}
+            if item.get('error') or response.get('status_code') != 200:
+                self.logger.error(f"Batch request {item['custom_id']} failed: {item.get('error') or response.get('body')}")
+                continue
+            body = response['body']
+            results[item['custom_id']] = (body['choices'][0]['message']['content'], body.get('usage'))
+        return results
+
+    def run_stage(self, stage: str, requests: Iterable[Tuple[str, Dict, Dict]],
+                  describe: Callable[[str], Tuple[str, str, str]]) -> Tuple[Dict[str, Tuple[str, Dict]], Dict[str, Dict]]:
+        """
+        Submit (or resume) every batch of a stage. Returns the message content and usage,
+        and the accounting of each request, both keyed by ``custom_id``. The usage of a
+        batch is added to the usage ledger once, when its output is downloaded;
+        ``describe`` maps a ``custom_id`` to its ``(model, image_path, kind)``.
+        """
+        state_path = os.path.join(self.batch_dir, f"{stage}_state.json")
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.logger.info(f"Resuming {stage} stage with {len(state['batches'])} batches")
+        else:
+            paths, accounting = self.write_batch_files(stage, requests)
+            state = {
+                'accounting': accounting,
+                'batches': [{'input': path, 'batch_id': None, 'output': None} for path in paths]
+            }
+
+        def save_state():
+            with open(f"{state_path}.part", 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(f"{state_path}.part", state_path)
+
+        # 先全部送出再輪詢，各批次可同時在伺服器端處理
+        for entry in state['batches']:
+            if entry['batch_id'] is None:
+                entry['batch_id'] = self.submit_batch(entry['input'])
+                save_state()
+
+        results = {}
+        for entry in state['batches']:
+            output_path = entry['output']
+            if output_path is None:
+                batch = self.wait_for_batch(entry['batch_id'])
+                self.logger.info(f"Batch {batch.id} finished with status {batch.status}")
+                output_path = entry['input'].replace('.jsonl', '_output.jsonl')
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    if batch.output_file_id:
+                        f.write(self.client.files.content(batch.output_file_id).text)
+                if batch.error_file_id:
+                    errors = self.client.files.content(batch.error_file_id).text
+                    self.logger.error(f"Batch {batch.id} errors:\n{errors}")
+            with open(output_path, 'r', encoding='utf-8') as f:
+                batch_results = self.read_batch_output(f.read())
+            if entry['output'] is None:
+                for custom_id, (_, usage) in batch_results.items():
+                    model, image_path, kind = describe(custom_id)
+                    self.usage_ledger.record(model, usage, image_path, kind, batch=True)
+                entry['output'] = output_path
+                save_state()
+            results.update(batch_results)
+        return results, state['accounting']
+
+    def generate_dataset_batch(self, landmark_names: List[str]):
+        """Generate the dataset of the given landmarks through two Batch API stages."""
+        jobs_path = os.path.join(self.batch_dir, 'jobs.json')
+        if os.path.exists(jobs_path):
+            with open(jobs_path, 'r', encoding='utf-8') as f:
+                jobs = json.load(f)
+        else:
+            jobs = {'wiki': {}, 'images': []}
+            if not self.wiki_cache.offline:
+                # 尚未快取的維基百科頁面先一次並行抓取
+                self.wiki_cache.prefetch(landmark_names)
+            for landmark_name in landmark_names:
+                self.logger.info(f"Processing {landmark_name}")
+                jobs['wiki'][landmark_name] = self.get_wiki_content(landmark_name)
+                jobs['images'].extend([landmark_name, image] for image in self.pending_images(landmark_name))
+            with open(jobs_path, 'w', encoding='utf-8') as f:
+                json.dump(jobs, f, ensure_ascii=False)
+        if jobs.get('completed'):
+            self.logger.info(f"Records of {jobs_path} were already written; use a new batch dir for a new run")
+            return
+
+        # 第一階段：所有圖片的初始描述
+        def description_requests():
+            for i, (landmark_name, image) in enumerate(jobs['images']):
+                image_path = os.path.join(self.base_folder, landmark_name, image)
+                try:
+                    request, input_tokens, image_tokens = self.build_description_request(image_path, landmark_name)
+                except Exception as e:
+                    self.logger.error(f"Error generating initial description: {e}")
+                    continue
+                yield f"description-{i}", request, {'input_tokens': input_tokens, 'image_tokens': image_tokens}
+
+        def describe(custom_id):
+            stage, i, *conv_type = custom_id.split('-', 2)
+            landmark_name, image = jobs['images'][int(i)]
+            image_path = os.path.join(self.base_folder, landmark_name, image)
+            if stage == 'description':
+                return self.better_model_name, image_path, 'description'
+            return self.model_name, image_path, conv_type[0]
+
+        descriptions, description_inputs = self.run_stage('descriptions', description_requests(), describe)
+        self.logger.info(f"Received {len(descriptions)}/{len(jobs['images'])} descriptions")
+
+        # 第二階段：每張已描述圖片的各種對話
+        def conversation_requests():
+            for i, (landmark_name, image) in enumerate(jobs['images']):
+                description, _ = descriptions.get(f"description-{i}", ("", None))
+                if not description:
+                    continue
+                for conv_type, (request, input_tokens, context_tokens) in self.build_conversation_requests(
+                        description, jobs['wiki'][landmark_name]).items():
+                    yield f"conversation-{i}-{conv_type}", request, {'input_tokens': input_tokens,
+                                                                     'context_tokens': context_tokens}
+
+        conversations_output, conversation_inputs = self.run_stage('conversations', conversation_requests(), describe)
+        conversation_types = defaultdict(list)
+        for custom_id in conversation_inputs:
+            _, i, conv_type = custom_id.split('-', 2)
+            conversation_types[int(i)].append(conv_type)
+
+        for i, (landmark_name, image) in enumerate(jobs['images']):
+            description, description_usage = descriptions.get(f"description-{i}", ("", None))
+            if not description:
+                self.mark_failed(self.base_folder, image, landmark_name, calls=1, error="no description")
+                continue
+            description_tokens = self.token_usage(output_content=description, model=self.better_model_name,
+                                                  response_usage=description_usage, batch=True,
+                                                  **description_inputs[f"description-{i}"])
+            conversations = {}
+            conversation_tokens = {}
+            for conv_type in conversation_types[i]:
+                custom_id = f"conversation-{i}-{conv_type}"
+                try:
+                    output_content, usage = conversations_output[custom_id]
+                    conversations[conv_type] = json.loads(self.extract_json(output_content))
+                    conversation_tokens[conv_type] = self.token_usage(output_content=output_content, model=self.model_name,
+                                                                      response_usage=usage, batch=True,
+                                                                      **conversation_inputs[custom_id])
+                except Exception as e:
+                    self.logger.error(f"Error generating {conv_type} conversation: {e}\n")
+                    conversations[conv_type] = None
+            self.save_record(self.base_folder, image, landmark_name, description, description_tokens,
+                             conversations, conversation_tokens)
+
+        jobs['completed'] = True
+        with open(jobs_path, 'w', encoding='utf-8') as f:
+            json.dump(jobs, f, ensure_ascii=False)
+
+    def generate_dataset(self, landmark_name: str):
+        """Generate dataset for all landmarks in the input folder."""
+        landmark_names = [landmark_name] if landmark_name else sorted(
+            name for name in os.listdir(self.base_folder) if os.path.isdir(os.path.join(self.base_folder, name)))
+        self.generate_dataset_batch(landmark_names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate dataset for Taiwan landmarks with the OpenAI Batch API.')
+    add_generator_arguments(parser)
+    parser.add_argument('--batch-dir',
+                       type=str,
+                       default='batches',
+                       help='Directory of batch input/output files and state; reuse it to resume a run')
+    parser.add_argument('--poll-interval',
+                       type=float,
+                       default=60,
+                       help='Seconds between batch status checks')
+    args = parser.parse_args()
+
+    generator = BatchTaiwanLandmarkDatasetGenerator(**generator_kwargs(args),
+                                                    batch_dir=args.batch_dir,
+                                                    poll_interval=args.poll_interval)
+    generator.generate_dataset(args.landmark)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
 import json
 import os
+import sys
+import argparse
+from collections import defaultdict
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from usage_ledger import LEDGER_FILENAME, UsageLedger
+
 GPT_4O_INPUT_1M = 2.5
 GPT_4O_OUTPUT_1M = 10
 
 GPT_4O_MINI_INPUT_1M = 0.150
 GPT_4O_MINI_OUTPUT_1M = 0.6
 
-# Fixed image input costs per file
+# 命中提示快取的輸入 token 與 Batch API 的請求皆為半價
+CACHED_INPUT_DISCOUNT = 0.5
+BATCH_DISCOUNT = 0.5
+
+# Fixed image input costs per file (records written before image tokens were recorded)
 IMAGE_INPUT_COST = 0.001913 + (0.003825 * 2)  # One initial cost plus two additional costs
 
 def calculate_cost(input_tokens, output_tokens, input_price_per_1m, output_price_per_1m):
@@ -55,19 +65,32 @@ def process_token_usage(token_usage):
             'tokens': token_usage['conversations']['usage_by_type']
         }
 
-    # Add fixed image input cost
+    # Image input cost: included in the API-reported prompt tokens, else the computed image
+    # tokens of the uploaded image when recorded, else the fixed cost
+    description_usage = token_usage.get('description', {}).get('usage', {})
+    image_tokens = description_usage.get('image_tokens')
+    if 'prompt_tokens' in description_usage:
+        image_cost = 0
+    elif image_tokens is not None:
+        image_cost = calculate_cost(image_tokens, 0, GPT_4O_INPUT_1M, GPT_4O_OUTPUT_1M)
+    else:
+        image_cost = IMAGE_INPUT_COST
     costs_breakdown['image_input'] = {
-        'cost': IMAGE_INPUT_COST
+        'cost': image_cost,
+        'tokens': image_tokens
     }
-    total_cost += IMAGE_INPUT_COST
+    total_cost += image_cost
 
     return {
         'total_cost': total_cost,
         'breakdown': costs_breakdown
     }
 
-def process_dataset(directory):
-    """Process all JSON files in the directory and its subdirectories."""
+def process_dataset(directory, skip=frozenset()):
+    """
+    Process all JSON files in the directory and its subdirectories, except the records
+    whose (landmark, image) is in ``skip``.
+    """
     total_dataset_cost = 0
     file_costs = []
 
@@ -75,10 +98,13 @@ def process_dataset(directory):
         with open(filepath, 'r', encoding='utf-8') as f:
             try:
                 data = json.load(f)
+                if (data.get('landmark_name', ''), data.get('image_path', '')) in skip:
+                    continue
                 if 'token_usage' in data:
                     cost_info = process_token_usage(data['token_usage'])
                     file_costs.append({
                         'file': str(filepath),
+                        'landmark': data.get('landmark_name', ''),
                         'cost_info': cost_info
                     })
                     total_dataset_cost += cost_info['total_cost']
@@ -91,12 +117,101 @@ def process_dataset(directory):
         'file_costs': file_costs
     }
 
+def model_prices(model):
+    """(input, output) price per 1M tokens of a model name as sent or as reported by the API."""
+    if model.startswith('gpt-4o-mini'):
+        return GPT_4O_MINI_INPUT_1M, GPT_4O_MINI_OUTPUT_1M
+    return GPT_4O_INPUT_1M, GPT_4O_OUTPUT_1M
+
+def ledger_costs(ledger_path):
+    """
+    Aggregate the usage ledger per landmark and model with SQL and price every group.
+    Also returns the (landmark, image) pairs that have ledger rows.
+    """
+    ledger = UsageLedger(os.path.dirname(ledger_path), path=ledger_path)
+    rows = ledger.totals(['landmark', 'model', 'batch', 'replayed'])
+    images = ledger.images()
+    ledger.close()
+
+    costs = []
+    for row in rows:
+        input_price, output_price = model_prices(row['model'])
+        cost = calculate_cost(row['prompt_tokens'] - row['cached_tokens'], row['completion_tokens'],
+                              input_price, output_price)
+        cost += calculate_cost(row['cached_tokens'], 0, input_price * CACHED_INPUT_DISCOUNT, 0)
+        if row['batch']:
+            cost *= BATCH_DISCOUNT
+        costs.append(dict(row, cost=0 if row['replayed'] else cost, replayed_cost=cost if row['replayed'] else 0))
+    return costs, images
+
+def print_ledger_costs(costs, file_costs=()):
+    """Print the ledger costs; ``file_costs`` are records without ledger rows, priced from their token_usage."""
+    by_landmark = defaultdict(lambda: {'requests': 0, 'cost': 0, 'replayed_cost': 0, 'records': 0})
+    by_model = defaultdict(lambda: {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0, 'cost': 0})
+    for row in costs:
+        landmark = by_landmark[row['landmark']]
+        model = by_model[row['model']]
+        for totals in (landmark, model):
+            totals['requests'] += row['requests']
+            totals['cost'] += row['cost']
+        landmark['replayed_cost'] += row['replayed_cost']
+        for key in ('prompt_tokens', 'cached_tokens', 'completion_tokens'):
+            model[key] += row[key]
+
+    # 帳本建立前產生的 record 沒有帳本紀錄，改以 record 內的 token_usage 計價
+    for file_cost in file_costs:
+        landmark = by_landmark[file_cost['landmark']]
+        landmark['records'] += 1
+        landmark['cost'] += file_cost['cost_info']['total_cost']
+
+    ledger_cost = sum(row['cost'] for row in costs)
+    record_cost = sum(file_cost['cost_info']['total_cost'] for file_cost in file_costs)
+    total_cost = ledger_cost + record_cost
+    if file_costs:
+        print(f"\nTotal Cost: ${total_cost:.4f} (usage ledger ${ledger_cost:.4f}, "
+              f"{len(file_costs)} records without ledger rows ${record_cost:.4f})")
+    else:
+        print(f"\nTotal Cost (usage ledger): ${total_cost:.4f}")
+    if not by_landmark:
+        print("No usage recorded.")
+        return
+    print(f"Average Cost per Landmark: ${total_cost / len(by_landmark):.4f}")
+    print("\nBy model:")
+    for name, totals in sorted(by_model.items()):
+        print(f"  {name}: {totals['requests']} requests, {totals['prompt_tokens']} prompt tokens "
+              f"({totals['cached_tokens']} cached), {totals['completion_tokens']} completion tokens, ${totals['cost']:.4f}")
+    print("\nBy landmark:")
+    for name, totals in sorted(by_landmark.items(), key=lambda item: -item[1]['cost']):
+        replayed = f" (+${totals['replayed_cost']:.4f} replayed from the response cache)" if totals['replayed_cost'] else ""
+        records = f" + {totals['records']} records without ledger rows" if totals['records'] else ""
+        print(f"  {name}: {totals['requests']} requests{records}, ${totals['cost']:.4f}{replayed}")
+
 def main():
-    dataset_dir = "dataset"
+    parser = argparse.ArgumentParser(description='Compute the API cost of the generated dataset.')
+    parser.add_argument('--dataset-dir', type=str, default='dataset')
+    parser.add_argument('--ledger', type=str, default=None,
+                        help=f'Usage ledger (default: {LEDGER_FILENAME} in the dataset dir); '
+                             'records are only read when it does not exist')
+    parser.add_argument('--include-unledgered', action='store_true',
+                        help='With a ledger, also read every record and price those without ledger rows '
+                             '(records written before the ledger existed) from their token_usage')
+    args = parser.parse_args()
+
+    ledger_path = args.ledger or os.path.join(args.dataset_dir, LEDGER_FILENAME)
+    if os.path.exists(ledger_path):
+        costs, images = ledger_costs(ledger_path)
+        # 預設只讀帳本；舊 record 需要逐一開啟，因此由使用者選擇是否加入
+        file_costs = process_dataset(args.dataset_dir, skip=images)['file_costs'] if args.include_unledgered else []
+        print_ledger_costs(costs, file_costs)
+        return
+
+    dataset_dir = args.dataset_dir
     results = process_dataset(dataset_dir)
     
     # Print results
     print(f"\nTotal Dataset Cost: ${results['total_dataset_cost']:.4f}")
+    if not results['file_costs']:
+        return
     print(f"Average Cost per File: ${results['total_dataset_cost'] / len(results['file_costs']):.4f}")
     print("\nBreakdown by file:")
     for file_cost in results['file_costs']:
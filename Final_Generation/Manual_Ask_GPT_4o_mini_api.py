@@ -10,14 +10,19 @@ import random
 import uuid
 import tiktoken
 import requests
-import wikipedia
 from typing import Dict, List, Any, Tuple
 import logging
 import regex
 import argparse
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from record_index import RecordIndex
+from wiki_cache import DEFAULT_CACHE_DIR, WikiCache
 
 class TaiwanLandmarkDatasetGenerator:
-    def __init__(self, api_key: str, base_folder: str = '/media/Pluto/stanley_hsu/TW_attraction/images/TW_Attractions'):
+    def __init__(self, api_key: str, base_folder: str = '/media/Pluto/stanley_hsu/TW_attraction/images/TW_Attractions', cluster_manifest: str = None,
+                 wiki_cache_dir: str = DEFAULT_CACHE_DIR, offline_wiki: bool = False):
         # Load environment variables
         load_dotenv()
         
@@ -29,6 +34,12 @@ class TaiwanLandmarkDatasetGenerator:
         self.api_key = api_key
         self.max_retries = 10
         
+        # 維基百科內容從本地快取讀取，可先用 wiki_cache.py 預先抓取以離線執行
+        self.wiki_cache = WikiCache(wiki_cache_dir, offline=offline_wiki)
+        
+        # 近似重複圖片群組（image_dedup.py 產生），只對每群的代表圖片呼叫 API
+        self.cluster_representatives = self.load_cluster_representatives(cluster_manifest)
+        
         # Initialize OpenAI client
         self.client = OpenAI(api_key=self.api_key)
         
@@ -49,6 +60,20 @@ class TaiwanLandmarkDatasetGenerator:
         
         # Create output directory if it doesn't exist
         os.makedirs(self.output_folder, exist_ok=True)
+        
+        # (景點, 圖片) → record 的索引，image_data_json_filter 用它做集合交集
+        self.record_index = RecordIndex(self.output_folder)
+
+    def load_cluster_representatives(self, cluster_manifest: str = None) -> Dict[str, set]:
+        """Load the representative images of each landmark from a cluster manifest."""
+        if not cluster_manifest:
+            return {}
+        with open(cluster_manifest, 'r', encoding='utf-8') as f:
+            clusters = json.load(f)['clusters']
+        return {
+            landmark: {os.path.basename(path) for cluster in landmark_clusters for path in cluster['representatives']}
+            for landmark, landmark_clusters in clusters.items()
+        }
 
     def count_tokens(self, text: str, model: str) -> int:
         """Count tokens for a given text using the appropriate tokenizer."""
@@ -61,14 +86,11 @@ class TaiwanLandmarkDatasetGenerator:
             return base64.b64encode(image_file.read()).decode('utf-8')
 
     def get_wiki_content(self, landmark_name: str) -> str:
-        """Fetch content from Wikipedia in Traditional Chinese."""
-        wikipedia.set_lang("zh-tw")
-        try:
-            page = wikipedia.page(landmark_name)
-            return page.content
-        except Exception as e:
-            self.logger.error(f"Error fetching Wikipedia content for {landmark_name}: {e}")
-            return ""
+        """Fetch content from Wikipedia in Traditional Chinese (served from the local wiki cache)."""
+        entry = self.wiki_cache.entry(landmark_name)
+        if entry['error']:
+            self.logger.error(f"Error fetching Wikipedia content for {landmark_name}: {entry['error']}")
+        return entry['content']
 
     def generate_initial_description(self, image_path: str, landmark_name: str) -> Tuple[str, Dict]:
         """生成初始描述並追蹤token使用量"""
@@ -334,6 +356,7 @@ class TaiwanLandmarkDatasetGenerator:
             
             with open(output_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            self.record_index.add(output_path, landmark_name, data.get('image_path', ''))
             self.logger.info(f"Dataset saved to {output_path}")
         except Exception as e:
             self.logger.error(f"Error saving dataset: {e}")
@@ -401,7 +424,13 @@ Total: {total_tokens['total_tokens']} tokens
         self.logger.info(f"Processing {landmark_name}")
         landmark_info = self.get_wiki_content(landmark_name)
         landmark_path = os.path.join(self.base_folder, landmark_name)
-        for image in os.listdir(landmark_path):
+        images = os.listdir(landmark_path)
+        if landmark_name in self.cluster_representatives:
+            representatives = self.cluster_representatives[landmark_name]
+            kept = [image for image in images if image in representatives]
+            self.logger.info(f"Skipping {len(images) - len(kept)} images of {landmark_name} that are not cluster representatives")
+            images = kept
+        for image in images:
             self.process_landmark(self.base_folder, image, landmark_name, landmark_info)
 
 def main():
@@ -413,13 +442,25 @@ def main():
     parser.add_argument('--landmark', 
                        type=str,
                        help='Specific landmark folder to process (optional). If not provided, will process all landmarks.')
+    parser.add_argument('--cluster-manifest',
+                       type=str,
+                       default=None,
+                       help='image_clusters.json from image_dedup.py; only cluster representatives are processed')
+    parser.add_argument('--wiki-cache-dir',
+                       type=str,
+                       default=DEFAULT_CACHE_DIR,
+                       help='Local Wikipedia cache (prefetch with wiki_cache.py)')
+    parser.add_argument('--offline-wiki',
+                       action='store_true',
+                       help='Never fetch Wikipedia; pages missing from the cache are treated as empty')
     parser.add_argument('--api-key',
                         type=str,
                         default=os.getenv('SELF_OPENAI_API_KEY'),
                         help='OpenAI API key')
     args = parser.parse_args()
 
-    generator = TaiwanLandmarkDatasetGenerator(base_folder=args.base_folder, api_key=args.api_key)
+    generator = TaiwanLandmarkDatasetGenerator(base_folder=args.base_folder, cluster_manifest=args.cluster_manifest, api_key=args.api_key,
+                                                wiki_cache_dir=args.wiki_cache_dir, offline_wiki=args.offline_wiki)
     generator.generate_dataset(args.landmark)
 
 if __name__ == "__main__":
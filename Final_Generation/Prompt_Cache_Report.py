@@ -0,0 +1,68 @@
+import json
+import argparse
+from collections import defaultdict
+from pathlib import Path
+from Count_Price import BATCH_DISCOUNT, CACHED_INPUT_DISCOUNT, GPT_4O_INPUT_1M, GPT_4O_MINI_INPUT_1M
+
+INPUT_PRICE_1M = {
+    'gpt-4o': GPT_4O_INPUT_1M,
+    'gpt-4o-mini': GPT_4O_MINI_INPUT_1M,
+}
+
+
+def record_usages(token_usage):
+    """(model, usage) of every call of a record."""
+    usages = []
+    if 'description' in token_usage:
+        usages.append((token_usage['description']['model'], token_usage['description']['usage']))
+    if 'conversations' in token_usage:
+        model = token_usage['conversations']['model']
+        usages.extend((model, usage) for usage in token_usage['conversations']['usage_by_type'].values())
+    return usages
+
+
+def cache_stats_by_landmark(directory):
+    """Sum prompt tokens, cached tokens and the money saved by the prompt cache per landmark."""
+    stats = defaultdict(lambda: {'records': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'saved': 0.0})
+    for filepath in Path(directory).rglob('*.json'):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                print(f"Error reading JSON file: {filepath}")
+                continue
+        if 'token_usage' not in data:
+            continue
+        landmark = stats[data.get('landmark_name', '')]
+        landmark['records'] += 1
+        for model, usage in record_usages(data['token_usage']):
+            # 沒有 API 回報用量的 record（舊資料）不列入；Batch API 的 record 以批次折扣後的價格計算節省
+            if 'prompt_tokens' not in usage:
+                continue
+            landmark['prompt_tokens'] += usage['prompt_tokens']
+            landmark['cached_tokens'] += usage['cached_tokens']
+            saved = (usage['cached_tokens'] / 1_000_000) * INPUT_PRICE_1M.get(model, 0) * CACHED_INPUT_DISCOUNT
+            landmark['saved'] += saved * BATCH_DISCOUNT if usage.get('batch') else saved
+    return dict(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the prompt cache hit ratio and savings per landmark.')
+    parser.add_argument('--dataset-dir', type=str, default='dataset')
+    args = parser.parse_args()
+
+    stats = cache_stats_by_landmark(args.dataset_dir)
+    total_prompt = sum(s['prompt_tokens'] for s in stats.values())
+    total_cached = sum(s['cached_tokens'] for s in stats.values())
+    total_saved = sum(s['saved'] for s in stats.values())
+
+    print(f"{'Landmark':<20} {'Records':>8} {'Prompt tokens':>14} {'Cached':>12} {'Hit ratio':>10} {'Saved':>10}")
+    for name, s in sorted(stats.items(), key=lambda item: -item[1]['saved']):
+        ratio = s['cached_tokens'] / s['prompt_tokens'] if s['prompt_tokens'] else 0
+        print(f"{name:<20} {s['records']:>8} {s['prompt_tokens']:>14} {s['cached_tokens']:>12} {ratio:>10.1%} ${s['saved']:>9.4f}")
+    ratio = total_cached / total_prompt if total_prompt else 0
+    print(f"\nTotal: {total_cached}/{total_prompt} prompt tokens cached ({ratio:.1%}), saved ${total_saved:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import json
 from openai import OpenAI
 from dotenv import load_dotenv
 from typing import List, Dict, Union
+from response_cache import ResponseCache, ResponseCacheMiss
 
 # 載入環境變數
 load_dotenv()
@@ -12,6 +13,9 @@ MODEL_NAME = 'gpt-4o'
 # 設置OpenAI API金鑰
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
+# 相同請求直接使用快取的回應；RESPONSE_CACHE_REPLAY=1 時只重播快取，未命中即失敗
+response_cache = ResponseCache(replay_only=os.getenv('RESPONSE_CACHE_REPLAY') == '1')
+
 
 def calculate_confidence_scores(data: Dict) -> List[Dict]:
     """
@@ -34,7 +38,8 @@ def calculate_confidence_scores(data: Dict) -> List[Dict]:
         """
 
         try:
-            response = client.chat.completions.create(
+            response = response_cache.create(
+                client,
                 model=MODEL_NAME,
                 messages=[
                     {"role": "system", "content": "你是一個專業的數據分析師，擅長評估資訊的準確性。"},
@@ -45,6 +50,8 @@ def calculate_confidence_scores(data: Dict) -> List[Dict]:
 
             confidence_score = float(
                 response.choices[0].message.content.strip())
+        except ResponseCacheMiss:
+            raise
         except Exception as e:
             print(f"計算信心分數時出錯: {e}")
             confidence_score = 0.0
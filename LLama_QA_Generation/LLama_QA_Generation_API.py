@@ -1,23 +1,39 @@
 import os
+import sys
 import json
 import requests
-import wikipedia
 import regex
 import base64
 from PIL import Image
 import io
 import time
+import functools
+import tiktoken
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from wiki_cache import WikiCache
+from wiki_context import DEFAULT_MAX_TOKENS, WikiContextBuilder
+
+# 與 Final_Generation 的生成器共用同一份本地維基百科快取
+wiki_cache = WikiCache(offline=os.getenv('WIKI_OFFLINE') == '1')
+
+# 只放入與圖片描述最相關的維基百科段落；WIKI_CONTEXT_TOKENS=0 則放入全文
+# tokenizer 第一次使用時才載入（首次載入需要下載 BPE 檔），離線模式下匯入本模組不需網路
+@functools.lru_cache(maxsize=None)
+def get_encoding():
+    return tiktoken.get_encoding('o200k_base')
+
+wiki_context = WikiContextBuilder(lambda text: len(get_encoding().encode(text)),
+                                  max_tokens=int(os.getenv('WIKI_CONTEXT_TOKENS', DEFAULT_MAX_TOKENS)) or None)
 
 def get_wiki_knowledge(topic):
-    """從維基百科獲取相關知識（繁體中文）"""
-    wikipedia.set_lang("zh-tw")  # 設定為繁體中文
-    try:
-        page = wikipedia.page(topic)
-        return page.content
-    except:
-        return "無法獲取維基百科內容"
+    """從維基百科獲取相關知識（繁體中文），優先讀取本地快取"""
+    content = wiki_cache.content(topic)
+    return content if content else "無法獲取維基百科內容"
 
 def generate_llama_data(image_path, gpt4_description, wiki_content, landmark_name):
+    wiki_content, context_tokens = wiki_context.build(wiki_content, gpt4_description)
+    print(f"維基百科內容：{context_tokens['wiki_tokens']} → {context_tokens['wiki_context_tokens']} tokens")
     multi_result = generate_llama_data_multi_turn(image_path, gpt4_description, wiki_content, landmark_name)
     single_result = generate_llama_data_single_turn(image_path, gpt4_description, wiki_content, landmark_name)
     result = {"multi_turn": multi_result, "detailed_explanation": single_result["detailed_explanation"], "complex_reasoning": single_result["complex_reasoning"]}
@@ -201,8 +217,8 @@ def extract_json(text):
         print("未找到有效的 JSON")
         return ""
 
-def save_to_json(data, landmark_name, number):
-    """將生成的資料保存為 JSON 文件"""
+def save_to_json(data, landmark_name, number, description_usage=None):
+    """將生成的資料保存為 JSON 文件；description_usage 為圖片描述請求的 token 用量（含影像 token）"""
     os.makedirs(f"dataset/{landmark_name}-{number}", exist_ok=True)
     
     # 獲取當前時間戳  
@@ -212,6 +228,8 @@ def save_to_json(data, landmark_name, number):
     
     # 保存多輪對話資料
     if "multi_turn" in data and data["multi_turn"] is not None:
+        if description_usage:
+            data["multi_turn"]["description_usage"] = description_usage
         filename = f"dataset/{landmark_name}-{number}/llama_generate_multi_turn_{formatted_time}.json"
         with open(filename, 'w', encoding='utf-8') as f:
             json.dump(data["multi_turn"], f, ensure_ascii=False, indent=4)
@@ -222,6 +240,8 @@ def save_to_json(data, landmark_name, number):
         "image_path": data.get("multi_turn", {}).get("image_path", ""),
         "qa_pairs": []
     }
+    if description_usage:
+        single_turn_data["description_usage"] = description_usage
     
     # 添加詳細解釋資料
     if "detailed_explanation" in data and data["detailed_explanation"] is not None:
@@ -238,13 +258,13 @@ def save_to_json(data, landmark_name, number):
             json.dump(single_turn_data, f, ensure_ascii=False, indent=4)
         print(f"已保存單次對話資料至 {filename}")
 
-def main(image_path, landmark_name, gpt4_description, number, wiki_content):
+def main(image_path, landmark_name, gpt4_description, number, wiki_content, description_usage=None):
 
     # 生成 Llama 資料
     llama_data = generate_llama_data(image_path, gpt4_description, wiki_content, landmark_name)
 
     # 保存資料
-    save_to_json(llama_data, landmark_name, number)
+    save_to_json(llama_data, landmark_name, number, description_usage)
 
     print(f"已完成 {landmark_name}-{number} 的資料生成。")
 
@@ -5,8 +5,8 @@ import wikipedia
 import time
 from openai import OpenAI
 from dotenv import load_dotenv
-import base64
 from LLama_QA_Generation_API import main, get_wiki_knowledge
+from image_prep import ImagePreparer, image_usage
 
 # Load environment variables
 load_dotenv()
@@ -16,13 +16,12 @@ client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 BASE_FOLDER = "/media/Pluto/stanley_hsu/TW_attraction/input_image/"
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+# 上傳前依 512px tile 配置縮圖並重新編碼
+image_preparer = ImagePreparer(model="gpt-4o-mini")
 
 def query_gpt4(image_path, landmark_name):
-    base64_image = encode_image(image_path)
     try:
+        prepared = image_preparer.prepare(image_path)
         response = client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
@@ -30,21 +29,23 @@ def query_gpt4(image_path, landmark_name):
                     "role": "user",
                     "content": [
                         {"type": "text", "text": f"這張圖片可能是台灣的{landmark_name}。請詳細描述圖片中的細節，並確認這是否確實為{landmark_name}。如果不是，請指出實際的景點名稱。"},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
+                        image_preparer.image_content(prepared)
                     ]
                 }
             ],
             max_tokens=500
         )
-        return response.choices[0].message.content
+        # 記錄實際上傳的影像 token 數（與原圖相比），用來衡量縮圖省下的費用
+        usage = {
+            "input_tokens": response.usage.prompt_tokens,
+            "output_tokens": response.usage.completion_tokens,
+            "total_tokens": response.usage.total_tokens,
+            **image_usage(prepared)
+        }
+        return response.choices[0].message.content, usage
     except Exception as e:
         print(f"Error querying GPT-4: {e}")
-        return None
+        return None, None
 
 def process_images():
     for landmark_name in os.listdir(BASE_FOLDER):
@@ -62,7 +63,7 @@ def process_images():
                 print(f"Processing image: {image_path}")
                 
                 # Query GPT-4 for description
-                gpt4_description = query_gpt4(image_path, landmark_name)
+                gpt4_description, description_usage = query_gpt4(image_path, landmark_name)
                 print(f"GPT-4 description: {gpt4_description}")
                 if not gpt4_description:
                     continue
@@ -75,7 +76,7 @@ def process_images():
                     continue
 
                 # Call main function
-                main(image_path, landmark_name, gpt4_description, number, wiki_content)
+                main(image_path, landmark_name, gpt4_description, number, wiki_content, description_usage)
 
                 # Optional: Add a delay to avoid rate limiting
                 time.sleep(1)
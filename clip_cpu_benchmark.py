@@ -0,0 +1,70 @@
+import time
+import argparse
+import logging
+import numpy as np
+import torch
+from clip import clip
+from clip_cpu import CPU_MODES, INT8_MIN_COSINE, INT8_MAX_SCORE_DIFF, prepare_cpu_model
+from image_data_filter import FACE_PROMPTS, ImageDataset, collect_image_paths, encode_prompts, face_scores
+
+# 設定logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def encode_all(model, images, batch_size):
+    features = []
+    with torch.no_grad():
+        for i in range(0, len(images), batch_size):
+            features.append(model.encode_image(images[i:i + batch_size]).float().numpy())
+    features = np.concatenate(features)
+    return features / np.linalg.norm(features, axis=-1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CPU execution modes of the CLIP face filter.')
+    parser.add_argument('--source-dir', type=str,
+                        default="/media/Pluto/stanley_hsu/TW_attraction/images/TW_Attractions")
+    parser.add_argument('--limit', type=int, default=256, help='Number of images to benchmark on')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--modes', type=str, nargs='+', choices=CPU_MODES, default=list(CPU_MODES))
+    args = parser.parse_args()
+
+    image_paths = collect_image_paths(args.source_dir)[:args.limit]
+    _, preprocess = clip.load("ViT-B/32", device="cpu")
+
+    # 先把圖片解碼好，只量測模型本身的吞吐量
+    dataset = ImageDataset(args.source_dir, transform=preprocess, image_paths=image_paths)
+    images = torch.stack([item[0] for item in (dataset[i] for i in range(len(dataset))) if item[0] is not None])
+    logging.info(f"使用 {len(images)} 張圖片進行測試")
+
+    reference = None
+    for mode in ['fp32'] + [m for m in args.modes if m != 'fp32']:
+        model, _ = clip.load("ViT-B/32", device="cpu")
+        model = prepare_cpu_model(model, mode, args.threads)
+        text_features = encode_prompts(model, FACE_PROMPTS, "cpu")
+
+        # 預熱一個批次（compiled 模式的編譯時間不計入）
+        encode_all(model, images[:args.batch_size], args.batch_size)
+        start = time.perf_counter()
+        features = encode_all(model, images, args.batch_size)
+        elapsed = time.perf_counter() - start
+        scores = face_scores(features, text_features)
+
+        if reference is None:
+            reference = (features, scores)
+            logging.info(f"{mode}: {len(images) / elapsed:.1f} 張/秒")
+            continue
+
+        cosine = (features * reference[0]).sum(axis=-1)
+        score_diff = np.abs(scores - reference[1])
+        within = cosine.min() >= INT8_MIN_COSINE and score_diff.max() <= INT8_MAX_SCORE_DIFF
+        logging.info(f"{mode}: {len(images) / elapsed:.1f} 張/秒，與 fp32 的最小 cosine {cosine.min():.4f}，"
+                     f"人臉分數最大差異 {score_diff.max():.4f}（{'符合' if within else '超出'}容許誤差）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import json
+import numpy as np
+from typing import List
+
+
+class EmbeddingStore:
+    """
+    Memory-mapped float16 matrix of CLIP image embeddings with a path → row index.
+
+    Rows are L2-normalised, so any re-scoring against text prompts is a single
+    matrix multiply. The matrix file grows in place as new images are added.
+    """
+    def __init__(self, store_dir: str, dim: int = 512, model_name: str = 'ViT-B/32'):
+        self.store_dir = store_dir
+        self.dim = dim
+        self.model_name = model_name
+        self.matrix_path = os.path.join(store_dir, 'embeddings.f16')
+        self.index_path = os.path.join(store_dir, 'index.json')
+        self.rows = {}
+
+        os.makedirs(store_dir, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index['dim'] != dim or index['model'] != model_name:
+                raise ValueError(
+                    f"Embedding store {store_dir} holds {index['model']} ({index['dim']}d) embeddings, "
+                    f"not {model_name} ({dim}d)")
+            self.rows = index['rows']
+
+        self._matrix = None
+        self._open(max(len(self.rows), 1024))
+
+    def _open(self, min_rows: int):
+        """Map the matrix file, growing it to at least ``min_rows`` rows."""
+        row_bytes = self.dim * np.dtype(np.float16).itemsize
+        current_rows = os.path.getsize(self.matrix_path) // row_bytes if os.path.exists(self.matrix_path) else 0
+        if current_rows < min_rows:
+            if self._matrix is not None:
+                self._matrix.flush()
+                self._matrix = None
+            with open(self.matrix_path, 'ab') as f:
+                f.truncate(min_rows * row_bytes)
+            current_rows = min_rows
+        if self._matrix is None:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float16, mode='r+', shape=(current_rows, self.dim))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.rows
+
+    def missing(self, paths: List[str]) -> List[str]:
+        return [path for path in paths if path not in self.rows]
+
+    def add(self, paths: List[str], features: np.ndarray):
+        """Store (or overwrite) the embeddings of ``paths``; ``features`` is (len(paths), dim)."""
+        features = features / np.linalg.norm(features, axis=-1, keepdims=True)
+        row_ids = []
+        for path in paths:
+            if path not in self.rows:
+                self.rows[path] = len(self.rows)
+            row_ids.append(self.rows[path])
+        if row_ids and max(row_ids) >= self._matrix.shape[0]:
+            self._open(max(max(row_ids) + 1, self._matrix.shape[0] * 2))
+        self._matrix[row_ids] = features.astype(np.float16)
+
+    def get(self, paths: List[str]) -> np.ndarray:
+        """Return the embeddings of ``paths`` as a float32 (len(paths), dim) array."""
+        return np.asarray(self._matrix[[self.rows[path] for path in paths]], dtype=np.float32)
+
+    def flush(self):
+        self._matrix.flush()
+        tmp_path = f"{self.index_path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'model': self.model_name, 'rows': self.rows}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
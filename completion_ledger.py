@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import hashlib
+from typing import Dict, Iterable, Optional
+
+LEDGER_FILENAME = '_completion_ledger.jsonl'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def record_key(image_path: str, config: Dict) -> str:
+    """Content address of a record: the image bytes plus the generator config that produced it."""
+    digest = hashlib.sha256(file_sha256(image_path).encode('utf-8'))
+    digest.update(json.dumps(config, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class CompletionLedger:
+    """
+    Append-only JSON Lines log of the outcome of every generated record.
+
+    Each line holds the record key, the image, the record file (if one was written),
+    ``status`` (``done`` or ``failed``) and the number of API calls the attempt made;
+    the last line of a key wins. A ``done`` entry whose record file is gone (deleted or
+    superseded by a record of a newer generator config) counts as not done. Runs append a ``run`` line with the number of images
+    skipped and API calls avoided.
+    """
+
+    def __init__(self, dataset_dir: str, path: Optional[str] = None):
+        self.dataset_dir = dataset_dir
+        self.path = path or os.path.join(dataset_dir, LEDGER_FILENAME)
+        self.entries: Dict[str, Dict] = {}
+        self.calls_avoided = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 寫入中斷留下的半行，該圖片下次會重新生成
+                        continue
+                    if 'run' in entry:
+                        self.calls_avoided += entry['calls_avoided']
+                    else:
+                        self.entries[entry['key']] = entry
+
+    def _append(self, entry: Dict):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def is_done(self, key: str) -> bool:
+        entry = self.entries.get(key)
+        if entry is None or entry['status'] != 'done':
+            return False
+        return not entry.get('record') or os.path.exists(os.path.join(self.dataset_dir, entry['record']))
+
+    def mark(self, key: str, landmark_name: str, image_path: str, status: str, calls: int,
+             record: Optional[str] = None, error: Optional[str] = None):
+        entry = {
+            'key': key,
+            'landmark_name': landmark_name,
+            'image_path': image_path,
+            'status': status,
+            'calls': calls,
+            'record': record,
+            'error': error,
+            'time': time.time()
+        }
+        self.entries[key] = entry
+        self._append(entry)
+
+    def record_run(self, skipped_keys: Iterable[str]) -> int:
+        """Log a run that skipped ``skipped_keys``; returns the API calls those records would have cost."""
+        skipped_keys = list(skipped_keys)
+        calls_avoided = sum(self.entries[key]['calls'] for key in skipped_keys)
+        self.calls_avoided += calls_avoided
+        self._append({'run': time.time(), 'skipped': len(skipped_keys), 'calls_avoided': calls_avoided})
+        return calls_avoided
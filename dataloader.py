@@ -7,6 +7,7 @@ import torchvision.transforms as transforms
 from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 import logging
+from filter_output import read_manifest
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
@@ -21,7 +22,8 @@ class TWAttractionDataset(Dataset):
         root_dir: str,
         tw_list_path: str,
         image_size: Tuple[int, int] = (224, 224),
-        max_tokens: int = 512
+        max_tokens: int = 512,
+        manifest_path: Optional[str] = None
     ):
         """
         Initialize the dataset
@@ -31,7 +33,18 @@ class TWAttractionDataset(Dataset):
             tw_list_path (str): Path to TW_List.json
             image_size (tuple): Target image size for resizing
             max_tokens (int): Maximum number of tokens for text
+            manifest_path (str, optional): accepted_records.json from image_data_json_filter;
+                records are read from the manifest's source directory instead of root_dir
         """
+        self.manifest = None
+        if manifest_path:
+            source_dir, paths = read_manifest(manifest_path)
+            root_dir = source_dir
+            self.manifest = {}
+            for path in paths:
+                self.manifest.setdefault(Path(path).parts[0], []).append(Path(source_dir) / path)
+            logger.info(f"Loaded {len(paths)} records from manifest {manifest_path}")
+
         self.root_dir = Path(root_dir)
         if not self.root_dir.exists():
             raise ValueError(f"Root directory does not exist: {root_dir}")
@@ -75,13 +88,17 @@ class TWAttractionDataset(Dataset):
         
         for attraction in self.tw_list:
                 
-            attraction_dir = self.root_dir / attraction
-            if not attraction_dir.exists():
-                logger.warning(f"Directory not found for attraction: {attraction}")
-                continue
-                
-            # Load all JSON files for this attraction
-            json_files = list(attraction_dir.glob('*.json'))
+            if self.manifest is not None:
+                # Only the records listed in the filter manifest
+                json_files = self.manifest.get(attraction, [])
+            else:
+                attraction_dir = self.root_dir / attraction
+                if not attraction_dir.exists():
+                    logger.warning(f"Directory not found for attraction: {attraction}")
+                    continue
+                    
+                # Load all JSON files for this attraction
+                json_files = list(attraction_dir.glob('*.json'))
             logger.info(f"Found {len(json_files)} JSON files for {attraction}")
             
             for json_path in json_files:
@@ -196,7 +213,8 @@ def create_dataloader(
     num_workers: int = 4,
     image_size: Tuple[int, int] = (224, 224),
     max_tokens: int = 512,
-    shuffle: bool = True
+    shuffle: bool = True,
+    manifest_path: Optional[str] = None
 ) -> DataLoader:
     """
     Create a DataLoader for the TWAttractionDataset
@@ -207,7 +225,8 @@ def create_dataloader(
         root_dir=root_dir,
         tw_list_path=tw_list_path,
         image_size=image_size,
-        max_tokens=max_tokens
+        max_tokens=max_tokens,
+        manifest_path=manifest_path
     )
     
     logger.info(f"Dataset created with {len(dataset)} samples")
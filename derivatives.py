@@ -0,0 +1,68 @@
+import os
+import io
+from collections import namedtuple
+from PIL import Image
+from download_engine import atomic_write
+
+# size 是短邊像素，與 CLIP 的 Resize(224) 一致；原圖較小時不放大
+DerivativeSpec = namedtuple('DerivativeSpec', ['name', 'size', 'format', 'quality'])
+
+DEFAULT_DERIVATIVES = (
+    DerivativeSpec('thumb_224', 224, 'JPEG', 90),
+    DerivativeSpec('upload_512', 512, 'WEBP', 85),
+)
+
+DERIVATIVE_DIR = '_derivatives'
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+
+def derivative_path(root: str, spec: DerivativeSpec, rel_path: str) -> str:
+    """Path of a derivative of ``root/rel_path``, e.g. ``root/_derivatives/thumb_224/{category}/{searchword}/x.jpg``."""
+    base, _ = os.path.splitext(rel_path)
+    return os.path.join(root, DERIVATIVE_DIR, spec.name, f"{base}.{EXTENSIONS[spec.format]}")
+
+
+def _resize_short_side(image: Image.Image, size: int) -> Image.Image:
+    width, height = image.size
+    scale = size / min(width, height)
+    if scale >= 1:
+        return image
+    return image.resize((round(width * scale), round(height * scale)), Image.BICUBIC)
+
+
+def make_derivatives(data: bytes, specs):
+    """Encode every spec from one decode of ``data``; returns ``{name: (bytes, width, height)}``."""
+    image = Image.open(io.BytesIO(data))
+    # JPEG 可直接以 1/2、1/4、1/8 尺寸解碼，只要不小於最大的衍生圖
+    largest = max(spec.size for spec in specs)
+    image.draft('RGB', (largest, largest))
+    image = image.convert('RGB')
+
+    outputs = {}
+    # 由大到小縮放，較小的衍生圖從上一張縮圖再縮
+    for spec in sorted(specs, key=lambda s: s.size, reverse=True):
+        image = _resize_short_side(image, spec.size)
+        buffer = io.BytesIO()
+        image.save(buffer, format=spec.format, quality=spec.quality)
+        outputs[spec.name] = (buffer.getvalue(), image.width, image.height)
+    return outputs
+
+
+def write_derivatives(data: bytes, root: str, rel_path: str, specs) -> dict:
+    """Write derivatives of ``data`` and return their manifest entries keyed by spec name."""
+    if not specs:
+        return {}
+
+    entries = {}
+    outputs = make_derivatives(data, specs)
+    for spec in specs:
+        encoded, width, height = outputs[spec.name]
+        path = derivative_path(root, spec, rel_path)
+        atomic_write(path, encoded)
+        entries[spec.name] = {
+            'path': os.path.relpath(path, root).replace(os.sep, '/'),
+            'width': width,
+            'height': height,
+            'size': len(encoded)
+        }
+    return entries
@@ -0,0 +1,122 @@
+import os
+import hashlib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from rate_limit import IMAGE_LIMITER, call_with_retry
+
+DownloadJob = namedtuple('DownloadJob', ['url', 'path'])
+DownloadResult = namedtuple('DownloadResult', ['job', 'ok', 'size', 'sha256', 'error', 'extra'])
+
+
+class SkippedDownload(Exception):
+    """Raised when the ``accept`` hook rejects downloaded bytes (e.g. a duplicate)."""
+
+
+def atomic_write(path: str, data: bytes):
+    """Write bytes through a temp file and rename, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ImageDownloader:
+    """Concurrent image downloader built on one pooled keep-alive session.
+
+    Jobs run on a bounded thread pool; each host gets its own semaphore so a
+    single CDN never sees more than ``per_host`` requests in flight.
+    """
+
+    def __init__(self, max_workers: int = 16, per_host: int = 8, timeout: float = 30, limiter=IMAGE_LIMITER):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.limiter = limiter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _get(self, url: str) -> bytes:
+        with self._host_slot(url):
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            return response.content
+
+    def fetch(self, url: str) -> bytes:
+        """Fetch a URL through the shared rate limiter and return the response body."""
+        return call_with_retry(self.limiter, self._get, url)
+
+    def _download_one(self, job: DownloadJob, pbar, accept, on_saved) -> DownloadResult:
+        data = b''
+        digest = None
+        extra = None
+        try:
+            data = self.fetch(job.url)
+            digest = hashlib.sha256(data).hexdigest()
+            if accept and not accept(job, digest):
+                raise SkippedDownload(f"{job.url} rejected")
+            atomic_write(job.path, data)
+            if on_saved:
+                extra = on_saved(job, data)
+        except Exception as e:
+            return DownloadResult(job, False, len(data), digest, e, extra)
+
+        with self._lock:
+            pbar.update(1)
+        return DownloadResult(job, True, len(data), digest, None, extra)
+
+    def download(self, jobs, pbar=None, desc: str = None, accept=None, on_saved=None):
+        """Download all jobs concurrently and return results in job order.
+
+        If ``pbar`` is given it is advanced once per successful download,
+        otherwise a bar covering just these jobs is created. ``accept(job, sha256)``
+        is called before a file is written; returning False skips the file.
+        ``on_saved(job, data)`` runs in the worker after the write, while the
+        bytes are still in memory; its return value is kept as ``result.extra``.
+        """
+        jobs = list(jobs)
+        own_pbar = pbar is None
+        if own_pbar:
+            pbar = tqdm(total=len(jobs), desc=desc)
+
+        try:
+            futures = [self._executor.submit(self._download_one, job, pbar, accept, on_saved) for job in jobs]
+            results = [future.result() for future in futures]
+        finally:
+            if own_pbar:
+                pbar.close()
+
+        for result in results:
+            if not result.ok and not isinstance(result.error, SkippedDownload):
+                print(f"Error downloading image: {result.error}")
+        return results
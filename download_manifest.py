@@ -0,0 +1,90 @@
+import os
+import json
+import re
+import hashlib
+from typing import Dict
+from download_engine import atomic_write
+
+
+class LandmarkManifest:
+    """Per-landmark record of downloaded photos and Flickr search progress.
+
+    ``photos`` maps each file slot ``n`` (``{searchword}-{n}.jpg``) to the Flickr
+    photo id, URL, byte size, SHA-256, status (``pending``/``done``/``failed``/
+    ``duplicate``) and resized derivatives of the photo stored there. ``page``/``offset`` point at the next
+    unseen search result. ``duplicates`` counts photos skipped as duplicates of
+    other landmarks, by photo id and by content.
+    """
+
+    def __init__(self, path: str, searchword: str):
+        self.path = path
+        self.searchword = searchword
+        self.page = 1
+        self.offset = 0
+        self.photos = {}
+        self.duplicates = {'photo_id': 0, 'content': 0}
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.page = data.get('page', 1)
+            self.offset = data.get('offset', 0)
+            self.photos = {int(n): entry for n, entry in data.get('photos', {}).items()}
+            self.duplicates.update(data.get('duplicates', {}))
+
+    def filename(self, n: int) -> str:
+        return f"{self.searchword}-{n}.jpg"
+
+    def adopt_existing(self, landmark_dir: str):
+        """Register files from a download made before manifests existed."""
+        pattern = re.compile(rf"^{re.escape(self.searchword)}-(\d+)\.jpg$")
+        for name in os.listdir(landmark_dir):
+            match = pattern.match(name)
+            if match and int(match.group(1)) not in self.photos:
+                with open(os.path.join(landmark_dir, name), 'rb') as f:
+                    data = f.read()
+                self.photos[int(match.group(1))] = {
+                    'id': None,
+                    'url': None,
+                    'size': len(data),
+                    'sha256': hashlib.sha256(data).hexdigest(),
+                    'status': 'done',
+                    'derivatives': {}
+                }
+
+    def is_complete(self, n: int, landmark_dir: str) -> bool:
+        """A slot is complete only if it is marked done and the file on disk matches."""
+        entry = self.photos.get(n)
+        if not entry or entry['status'] != 'done':
+            return False
+        path = os.path.join(landmark_dir, self.filename(n))
+        return os.path.exists(path) and os.path.getsize(path) == entry['size']
+
+    def retry_candidates(self, slots):
+        """Photos already chosen for the given (incomplete) slots, to be fetched again."""
+        return [
+            {'id': self.photos[n]['id'], 'url': self.photos[n]['url']}
+            for n in slots
+            if n in self.photos and self.photos[n]['url'] and self.photos[n]['status'] != 'duplicate'
+        ]
+
+    def mark(self, n: int, photo: Dict, status: str, size: int = 0, sha256: str = None,
+             derivatives: Dict = None):
+        self.photos[n] = {
+            'id': photo['id'],
+            'url': photo['url'],
+            'size': size,
+            'sha256': sha256,
+            'status': status,
+            'derivatives': derivatives or {}
+        }
+
+    def save(self):
+        data = {
+            'searchword': self.searchword,
+            'page': self.page,
+            'offset': self.offset,
+            'duplicates': self.duplicates,
+            'photos': {str(n): self.photos[n] for n in sorted(self.photos)}
+        }
+        atomic_write(self.path, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
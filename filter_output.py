@@ -0,0 +1,68 @@
+import os
+import json
+import errno
+import fcntl
+import shutil
+from typing import List, Tuple
+
+OUTPUT_MODES = ('copy', 'hardlink', 'reflink', 'manifest')
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def _reflink(src: str, dst: str):
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def place_file(src: str, dst: str, mode: str = 'copy') -> str:
+    """
+    Materialise ``src`` at ``dst`` according to ``mode``.
+
+    ``hardlink`` and ``reflink`` fall back to a copy when the filesystem cannot
+    share the data (different device, no reflink support). ``manifest`` writes
+    nothing; the caller records the path instead. Returns the mode actually used.
+    """
+    if mode == 'manifest':
+        return mode
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return mode
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+    elif mode == 'reflink':
+        try:
+            _reflink(src, dst)
+            return mode
+        except OSError as e:
+            if os.path.exists(dst):
+                os.remove(dst)
+            if e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY):
+                raise
+
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def write_manifest(path: str, source_dir: str, paths: List[str]):
+    """Write the accepted ``paths`` (relative to ``source_dir``) of a filter stage."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'source_dir': source_dir, 'paths': sorted(paths)}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(path: str) -> Tuple[str, List[str]]:
+    """Return ``(source_dir, relative paths)`` from a filter manifest."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data['source_dir'], data['paths']
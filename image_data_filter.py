@@ -1,14 +1,22 @@
 import os
+import re
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import torch
 from PIL import Image
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, default_collate
 from torchvision.transforms import Compose, Resize, ToTensor, Normalize
 from clip import clip
-import shutil
 import cv2
 import numpy as np
 from tqdm import tqdm
 import logging
+from clip_embedding_store import EmbeddingStore
+from clip_cpu import CPU_MODES, prepare_cpu_model
+from filter_output import OUTPUT_MODES, place_file, write_manifest
 
 # 設定logging
 logging.basicConfig(
@@ -16,20 +24,69 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+FACE_PROMPTS = [
+    "a photo of a face",
+    "a photo containing human face",
+    "a portrait photo",
+    "a selfie",
+    "a person",
+    "people in the photo"
+]
+
+# 預設的景點清單，與本檔案位於同一目錄，不受工作目錄影響
+DEFAULT_LANDMARK_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TW_List.json')
+
+# 像素值落在兩端 CLIP_LEVEL 以內視為曝光裁切（全黑/全白）
+CLIP_LEVEL = 2
+
+
+def image_quality(image, original_size):
+    """
+    以已解碼的圖片計算品質指標，不需要再讀一次檔案：
+    Laplacian 變異數（模糊程度，於 draft 縮小後的影像上計算）、過暗/過亮像素比例，
+    以及原始尺寸的最短邊與長寬比。
+    """
+    gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+    histogram = np.bincount(gray.ravel(), minlength=256)
+    width, height = original_size
+    return {
+        'sharpness': float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        'dark_clipped': float(histogram[:CLIP_LEVEL + 1].sum() / gray.size),
+        'bright_clipped': float(histogram[255 - CLIP_LEVEL:].sum() / gray.size),
+        'min_side': min(width, height),
+        'aspect_ratio': max(width, height) / max(min(width, height), 1)
+    }
+
+
+def passes_quality(quality, min_sharpness, max_clipped, min_side, max_aspect_ratio):
+    return (quality['sharpness'] >= min_sharpness
+            and quality['dark_clipped'] <= max_clipped
+            and quality['bright_clipped'] <= max_clipped
+            and quality['min_side'] >= min_side
+            and quality['aspect_ratio'] <= max_aspect_ratio)
+
+
+def collect_image_paths(root_dir):
+    """收集 root_dir 下各景點子目錄的圖片路徑"""
+    image_paths = []
+    for subdir in os.listdir(root_dir):
+        subdir_path = os.path.join(root_dir, subdir)
+        if os.path.isdir(subdir_path):
+            for img_name in os.listdir(subdir_path):
+                if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
+                    image_paths.append(os.path.join(subdir_path, img_name))
+    return image_paths
+
+
 class ImageDataset(Dataset):
-    def __init__(self, root_dir, transform=None):
+    def __init__(self, root_dir, transform=None, image_paths=None, draft_size=224):
         self.root_dir = root_dir
         self.transform = transform
-        self.image_paths = []
-        
-        # 遍歷所有子目錄收集圖片路徑
-        for subdir in os.listdir(root_dir):
-            subdir_path = os.path.join(root_dir, subdir)
-            if os.path.isdir(subdir_path):
-                for img_name in os.listdir(subdir_path):
-                    if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
-                        self.image_paths.append(os.path.join(subdir_path, img_name))
-        
+        self.draft_size = draft_size
+
+        # 未指定圖片清單時，遍歷所有子目錄收集圖片路徑
+        self.image_paths = image_paths if image_paths is not None else collect_image_paths(root_dir)
+
         logging.info(f"找到 {len(self.image_paths)} 張圖片")
 
     def __len__(self):
@@ -38,93 +95,461 @@ class ImageDataset(Dataset):
     def __getitem__(self, idx):
         img_path = self.image_paths[idx]
         try:
-            image = Image.open(img_path).convert('RGB')
+            image = Image.open(img_path)
+            original_size = image.size
+            if self.draft_size:
+                # JPEG 直接以 1/2、1/4、1/8 縮小解碼，短邊仍不小於 CLIP 的輸入尺寸
+                image.draft('RGB', (self.draft_size, self.draft_size))
+            image = image.convert('RGB')
+            # 品質指標在同一個 worker 中以解碼後的影像計算
+            quality = image_quality(image, original_size)
             if self.transform:
                 image = self.transform(image)
-            return image, img_path
+            return image, img_path, None, quality
         except Exception as e:
             logging.error(f"讀取圖片失敗 {img_path}: {str(e)}")
-            return None
+            return None, img_path, str(e), None
+
+
+def collate_skip_failed(batch):
+    """合併成功解碼的圖片，讀取失敗的圖片另外回傳，避免整個批次崩潰"""
+    good = [(image, path) for image, path, _, _ in batch if image is not None]
+    failed = [(path, error) for image, path, error, _ in batch if image is None]
+    qualities = {path: quality for image, path, _, quality in batch if image is not None}
+    if not good:
+        return None, [], failed, qualities
+    images, paths = default_collate(good)
+    return images, paths, failed, qualities
+
+
+def load_state(state_path):
+    """讀取增量模式的狀態檔：每張圖片的 mtime/size、人臉分數、品質指標與是否保留"""
+    if not os.path.exists(state_path):
+        return {'threshold': None, 'prompts': None, 'output_mode': None, 'images': {}}
+    with open(state_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state_path, state):
+    tmp_path = f"{state_path}.part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, state_path)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def iter_encoded_batches(model, preprocess, source_dir, image_paths, device, batch_size=32, num_workers=4,
+                         prefetch_factor=2, stats=None, progress=True):
+    """
+    逐批解碼並編碼圖片，產生 (路徑清單, 特徵矩陣, 無法解碼的 (路徑, 錯誤訊息) 清單, {路徑: 品質指標})。
+    stats 會累計等待解碼與模型編碼的秒數，用來分辨瓶頸在哪一段。
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('decode_seconds', 0.0)
+    stats.setdefault('encode_seconds', 0.0)
+
+    dataset = ImageDataset(source_dir, transform=preprocess, image_paths=image_paths)
+    loader_kwargs = {'prefetch_factor': prefetch_factor, 'persistent_workers': False} if num_workers > 0 else {}
+    dataloader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                            collate_fn=collate_skip_failed, pin_memory=device == "cuda", **loader_kwargs)
+
+    with torch.no_grad():
+        batches = iter(tqdm(dataloader) if progress else dataloader)
+        while True:
+            # 等待 DataLoader 的時間即為解碼瓶頸，模型前向的時間為編碼瓶頸
+            wait_start = time.perf_counter()
+            try:
+                images, paths, failed, qualities = next(batches)
+            except StopIteration:
+                break
+            stats['decode_seconds'] += time.perf_counter() - wait_start
+            if images is None:
+                yield [], None, failed, qualities
+                continue
+
+            encode_start = time.perf_counter()
+            # 將圖片移到GPU（如果可用）
+            images = images.to(device, non_blocking=True)
+
+            # 獲取圖片特徵
+            image_features = model.encode_image(images).float().cpu().numpy()
+            stats['encode_seconds'] += time.perf_counter() - encode_start
+            yield list(paths), image_features, failed, qualities
+
+
+def encode_shard(image_paths, source_dir, cpu_mode, threads, batch_size):
+    """多進程模式下每個子進程執行的工作：自行載入模型並編碼一部分圖片"""
+    model, preprocess = clip.load("ViT-B/32", device="cpu")
+    model = prepare_cpu_model(model, cpu_mode, threads)
+
+    stats = {}
+    paths, features, quarantined, qualities = [], [], [], {}
+    for batch_paths, batch_features, failed, batch_qualities in iter_encoded_batches(
+            model, preprocess, source_dir, image_paths, "cpu", batch_size=batch_size,
+            num_workers=0, stats=stats, progress=False):
+        quarantined.extend(failed)
+        qualities.update(batch_qualities)
+        if batch_features is not None:
+            paths.extend(batch_paths)
+            features.append(batch_features)
+    features = np.concatenate(features) if features else None
+    return paths, features, quarantined, qualities, stats
+
+
+def encode_images(model, preprocess, store, source_dir, image_paths, device, batch_size=32, num_workers=4,
+                  prefetch_factor=2, processes=1, cpu_mode='fp32', threads=None):
+    """
+    對指定圖片執行 CLIP 影像編碼並寫入 embedding store（已存在的列會被覆寫）。
+    CPU 上 processes > 1 時，圖片清單會切分給多個子進程各自編碼。
+    回傳無法解碼的 (路徑, 錯誤訊息) 清單，以及 {相對路徑: 品質指標}。
+    """
+    if not image_paths:
+        return [], {}
+
+    quarantined = []
+    qualities = {}
+    encoded_count = 0
+    stats = {'decode_seconds': 0.0, 'encode_seconds': 0.0}
+    start = time.perf_counter()
+
+    if processes > 1 and device == "cpu":
+        shards = [image_paths[i::processes] for i in range(processes)]
+        # 子進程平分 intra-op 執行緒，避免互相搶 CPU
+        shard_threads = max(1, (threads or torch.get_num_threads()) // processes)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [
+                executor.submit(encode_shard, shard, source_dir, cpu_mode, shard_threads, batch_size)
+                for shard in shards if shard
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                paths, features, failed, shard_qualities, shard_stats = future.result()
+                quarantined.extend(failed)
+                qualities.update(shard_qualities)
+                if features is not None:
+                    store.add([os.path.relpath(p, source_dir) for p in paths], features)
+                    encoded_count += len(paths)
+                for key in stats:
+                    stats[key] += shard_stats[key]
+    else:
+        for paths, features, failed, batch_qualities in iter_encoded_batches(
+                model, preprocess, source_dir, image_paths, device, batch_size=batch_size,
+                num_workers=num_workers, prefetch_factor=prefetch_factor, stats=stats):
+            quarantined.extend(failed)
+            qualities.update(batch_qualities)
+            if features is not None:
+                store.add([os.path.relpath(p, source_dir) for p in paths], features)
+                encoded_count += len(paths)
+
+    store.flush()
+
+    elapsed = time.perf_counter() - start
+    logging.info(f"編碼 {encoded_count} 張圖片，耗時 {elapsed:.1f} 秒（{encoded_count / max(elapsed, 1e-9):.1f} 張/秒）；"
+                 f"等待解碼 {stats['decode_seconds']:.1f} 秒，模型編碼 {stats['encode_seconds']:.1f} 秒，"
+                 f"無法讀取 {len(quarantined)} 張")
+    return quarantined, {os.path.relpath(p, source_dir): quality for p, quality in qualities.items()}
+
+
+def encode_prompts(model, prompts, device):
+    """編碼文字提示並正規化，回傳 (len(prompts), dim) 的 numpy 陣列"""
+    with torch.no_grad():
+        text_features = model.encode_text(clip.tokenize(prompts).to(device)).float()
+        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+    return text_features.cpu().numpy()
+
+
+def face_scores(image_features, text_features):
+    """以矩陣乘法一次計算所有圖片對人臉提示的最大 softmax 相似度"""
+    logits = 100.0 * image_features @ text_features.T
+    logits -= logits.max(axis=-1, keepdims=True)
+    similarity = np.exp(logits)
+    similarity /= similarity.sum(axis=-1, keepdims=True)
+    return similarity.max(axis=-1)
+
+
+def load_landmark_names(list_path):
+    """讀取 TW_List.json 格式的景點清單，回傳所有類別的景點名稱集合；清單不存在時回傳 None"""
+    if not os.path.exists(list_path):
+        return None
+    with open(list_path, 'r', encoding='utf-8') as f:
+        landmark_list = json.load(f)
+    return {name for names in landmark_list.values() for name in names}
+
+
+def landmark_aliases(name):
+    """「九份(九份老街)」這類名稱拆成多個別名，各自產生一個文字提示"""
+    aliases = [alias.strip() for alias in re.split(r'[()（）]', name) if alias.strip()]
+    return aliases or [name]
+
+
+def encode_landmarks(model, names, device, template="a photo of {}"):
+    """每個景點的別名提示取平均後正規化，回傳 (len(names), dim) 的 numpy 陣列"""
+    features = []
+    for name in names:
+        prompts = [template.format(alias) for alias in landmark_aliases(name)]
+        alias_features = encode_prompts(model, prompts, device).mean(axis=0)
+        features.append(alias_features / np.linalg.norm(alias_features))
+    return np.stack(features)
+
+
+def relevance_scores(image_features, landmark_features, landmark_index):
+    """每張圖片與所屬景點文字 embedding 的 cosine similarity（一次計算整批）"""
+    image_features = image_features / np.linalg.norm(image_features, axis=-1, keepdims=True)
+    return np.einsum('nd,nd->n', image_features, landmark_features[landmark_index])
+
+
+def relevance_cutoffs(scores, landmark_index, percentile):
+    """各景點內部排名，回傳每張圖片所屬景點的相關度下限（低於此百分位數者剔除）"""
+    cutoffs = np.full(len(scores), -np.inf, dtype=np.float32)
+    if percentile <= 0:
+        return cutoffs
+    for landmark in np.unique(landmark_index):
+        mask = landmark_index == landmark
+        cutoffs[mask] = np.percentile(scores[mask], percentile)
+    return cutoffs
+
 
 def main():
+    parser = argparse.ArgumentParser(description='Filter out landmark images that contain faces using CLIP.')
+    parser.add_argument('--source-dir', type=str,
+                        default="/media/Pluto/stanley_hsu/TW_attraction/images/TW_Attractions")
+    parser.add_argument('--target-dir', type=str,
+                        default="/media/Pluto/stanley_hsu/TW_attraction/Small_Filter_Images")
+    parser.add_argument('--store-dir', type=str,
+                        default="/media/Pluto/stanley_hsu/TW_attraction/clip_embeddings",
+                        help='Directory of the persisted CLIP image embedding store')
+    parser.add_argument('--threshold', type=float, default=0.4,
+                        help='Images whose face similarity is below this value are kept')
+    parser.add_argument('--prompts', type=str, nargs='+', default=FACE_PROMPTS,
+                        help='Text prompts describing images to reject')
+    parser.add_argument('--state-file', type=str, default=None,
+                        help='Incremental state file (default: <target-dir>/.filter_state.json)')
+    parser.add_argument('--full', action='store_true',
+                        help='Ignore the incremental state and reprocess every image')
+    parser.add_argument('--output-mode', type=str, choices=OUTPUT_MODES, default='copy',
+                        help='How accepted images reach the target dir; "manifest" only writes the manifest')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Manifest of accepted images (default: <target-dir>/accepted_images.json)')
+    parser.add_argument('--quarantine-file', type=str, default=None,
+                        help='List of unreadable images (default: <target-dir>/quarantine.txt)')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-workers', type=int, default=4)
+    parser.add_argument('--prefetch-factor', type=int, default=2,
+                        help='Batches each DataLoader worker decodes ahead')
+    parser.add_argument('--cpu-mode', type=str, choices=CPU_MODES, default='fp32',
+                        help='Image encoder execution mode when running on CPU (see clip_cpu.py for int8 tolerance)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Intra-op threads for CPU inference (default: torch default)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='On CPU, shard the images across this many encoder processes')
+    parser.add_argument('--landmark-list', type=str, default=DEFAULT_LANDMARK_LIST,
+                        help='Landmark list used to warn about image directories that are not listed')
+    parser.add_argument('--landmark-template', type=str, default='a photo of {}',
+                        help='Text prompt template for a landmark name')
+    parser.add_argument('--relevance-percentile', type=float, default=10,
+                        help='Within each landmark, drop images whose relevance is below this percentile (0 disables)')
+    parser.add_argument('--min-sharpness', type=float, default=50.0,
+                        help='Minimum Laplacian variance (measured on the draft-decoded image)')
+    parser.add_argument('--max-clipped', type=float, default=0.25,
+                        help='Maximum fraction of pixels clipped to black or to white')
+    parser.add_argument('--min-side', type=int, default=224,
+                        help='Minimum length of the shorter side in original pixels')
+    parser.add_argument('--max-aspect-ratio', type=float, default=3.0,
+                        help='Maximum ratio of the longer to the shorter side')
+    args = parser.parse_args()
+
     # 設定來源和目標目錄
-    source_dir = "/media/Pluto/stanley_hsu/TW_attraction/images/TW_Attractions"
-    target_dir = "/media/Pluto/stanley_hsu/TW_attraction/Small_Filter_Images"
-    
+    source_dir = args.source_dir
+    target_dir = args.target_dir
+
     # 確保目標目錄存在
     os.makedirs(target_dir, exist_ok=True)
-    
+
     # 載入CLIP模型
     device = "cuda" if torch.cuda.is_available() else "cpu"
     logging.info(f"使用設備: {device}")
-    
+
     model, preprocess = clip.load("ViT-B/32", device=device)
-    
-    # 準備文本提示
-    text_inputs = torch.cat([
-        clip.tokenize("a photo of a face"),
-        clip.tokenize("a photo containing human face"),
-        clip.tokenize("a portrait photo"),
-        clip.tokenize("a selfie"),
-        clip.tokenize("a person"),
-        clip.tokenize("people in the photo")
-    ]).to(device)
-    
-    # 創建數據集和數據載入器
-    dataset = ImageDataset(
-        source_dir,
-        transform=preprocess
-    )
-    dataloader = DataLoader(dataset, batch_size=32, num_workers=4)
-    
-    threshold = 0.4
-    
-    copied_count = 0
-    total_processed = 0
-    
+    if device == "cpu":
+        model = prepare_cpu_model(model, args.cpu_mode, args.threads)
+        logging.info(f"CPU 推論模式: {args.cpu_mode}，執行緒數: {torch.get_num_threads()}，進程數: {args.processes}")
+    store = EmbeddingStore(args.store_dir, dim=model.visual.output_dim, model_name="ViT-B/32")
+
+    image_paths = collect_image_paths(source_dir)
+    logging.info(f"找到 {len(image_paths)} 張圖片")
+    # 景點清單只用於提示未列出的目錄，在耗時的解碼前讀取
+    landmark_names = load_landmark_names(args.landmark_list)
+    if landmark_names is None:
+        logging.info(f"找不到景點清單 {args.landmark_list}，略過景點清單檢查")
+
+    state_path = args.state_file or os.path.join(target_dir, '.filter_state.json')
+    state = {'threshold': None, 'prompts': None, 'output_mode': None, 'images': {}} if args.full else load_state(state_path)
+    # 輸出模式改變時，所有保留的圖片都要依新模式重新輸出
+    mode_changed = state.get('output_mode') != args.output_mode
+    config_changed = state['threshold'] != args.threshold or state['prompts'] != args.prompts or mode_changed
+
+    # 依 mtime/size 判斷哪些圖片是新的、有變動或未變動
+    new_paths, changed_paths, unchanged_paths = [], [], []
+    signatures = {}
+    for img_path in image_paths:
+        relative_path = os.path.relpath(img_path, source_dir)
+        signatures[relative_path] = file_signature(img_path)
+        previous = state['images'].get(relative_path)
+        if previous is None:
+            new_paths.append(img_path)
+        elif (previous['mtime_ns'], previous['size']) != (signatures[relative_path]['mtime_ns'], signatures[relative_path]['size']):
+            changed_paths.append(img_path)
+        else:
+            unchanged_paths.append(img_path)
+
     logging.info("開始處理圖片...")
-    
-    with torch.no_grad():
-        for images, image_paths in tqdm(dataloader):
-            # 將圖片移到GPU（如果可用）
-            images = images.to(device)
-            
-            # 獲取圖片特徵
-            image_features = model.encode_image(images)
-            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-            
-            # 獲取文本特徵
-            text_features = model.encode_text(text_inputs)
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-            
-            # 計算相似度
-            similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
-            max_similarity = similarity.max(dim=-1)[0]
-            
-            # 處理每張圖片
-            for idx, (sim, img_path) in enumerate(zip(max_similarity, image_paths)):
-                total_processed += 1
-                
-                # 記錄相似度分數
-                logging.debug(f"圖片 {img_path} 的人臉相似度: {sim.item():.4f}")
-                
-                if sim.item() < threshold:  # 如果相似度低於閾值，表示沒有明顯人臉
-                    # 保持原始目錄結構
-                    relative_path = os.path.relpath(img_path, source_dir)
-                    target_path = os.path.join(target_dir, relative_path)
-                    
-                    # 確保目標目錄存在
-                    os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                    
-                    try:
-                        # 複製圖片
-                        shutil.copy2(img_path, target_path)
-                        copied_count += 1
-                    except Exception as e:
-                        logging.error(f"複製圖片失敗 {img_path}: {str(e)}")
-
-    logging.info(f"處理完成！總共處理 {total_processed} 張圖片，複製了 {copied_count} 張圖片")
-    logging.info(f"篩選率: {(copied_count/total_processed)*100:.2f}%")
+    # 新增與有變動的圖片必須解碼（取得品質指標）並編碼；未變動的只編碼 embedding store 中還沒有的（已隔離的除外）
+    to_encode = changed_paths + new_paths
+    still_quarantined = {
+        os.path.relpath(p, source_dir) for p in unchanged_paths
+        if state['images'][os.path.relpath(p, source_dir)].get('quarantined')
+    }
+    # 品質指標只在解碼時計算，沒有品質紀錄的圖片（例如舊版狀態檔）也要重新經過一次解碼
+    to_encode += [
+        p for p in unchanged_paths
+        if (os.path.relpath(p, source_dir) not in store
+            or 'quality' not in state['images'][os.path.relpath(p, source_dir)])
+        and os.path.relpath(p, source_dir) not in still_quarantined
+    ]
+    logging.info(f"需要編碼 {len(to_encode)} 張圖片，{len(image_paths) - len(to_encode)} 張已有快取")
+    quarantined, qualities = encode_images(model, preprocess, store, source_dir, to_encode, device,
+                                batch_size=args.batch_size, num_workers=args.num_workers,
+                                prefetch_factor=args.prefetch_factor, processes=args.processes,
+                                cpu_mode=args.cpu_mode, threads=args.threads)
+
+    # 無法讀取的圖片記錄在狀態檔中，檔案未變動前不再重試；狀態檔儲存後才寫入隔離清單
+    quarantined_paths = {os.path.relpath(p, source_dir) for p, _ in quarantined}
+    for relative_path in quarantined_paths:
+        state['images'][relative_path] = dict(signatures[relative_path], face_score=None,
+                                              accepted=False, quarantined=True)
+        target_path = os.path.join(target_dir, relative_path)
+        if os.path.exists(target_path):
+            os.remove(target_path)
+
+    # 設定未變時，未變動的圖片完全略過；更換閾值或提示時只需用 embedding store 重新計算分數
+    # 被隔離的圖片（本次或先前）不計分
+    to_score = [
+        p for p in new_paths + changed_paths + (unchanged_paths if config_changed else [])
+        if os.path.relpath(p, source_dir) not in quarantined_paths
+        and os.path.relpath(p, source_dir) not in still_quarantined
+    ]
+    text_features = encode_prompts(model, args.prompts, device)
+    relative_paths = [os.path.relpath(p, source_dir) for p in to_score]
+    scores = face_scores(store.get(relative_paths), text_features)
+    unchanged_relative = {os.path.relpath(p, source_dir) for p in unchanged_paths}
+    for relative_path, sim in zip(relative_paths, scores):
+        # 記錄相似度分數
+        logging.debug(f"圖片 {relative_path} 的人臉相似度: {sim:.4f}")
+        if relative_path in unchanged_relative:
+            # 只重新計分的圖片保留原有紀錄（品質指標、是否已輸出）
+            state['images'][relative_path].update(signatures[relative_path], face_score=float(sim))
+        else:
+            state['images'][relative_path] = dict(signatures[relative_path], face_score=float(sim))
+    for relative_path, quality in qualities.items():
+        state['images'][relative_path]['quality'] = quality
+
+    # 景點相關度：每張圖片與所屬景點名稱的文字 embedding 比較，並在景點內部排名。
+    # 百分位數門檻會隨景點的圖片組成改變，因此每次都以 embedding store 重新計算所有圖片
+    scorable_paths = [
+        os.path.relpath(p, source_dir) for p in image_paths
+        if os.path.relpath(p, source_dir) not in quarantined_paths
+        and os.path.relpath(p, source_dir) not in still_quarantined
+    ]
+    path_landmarks = [relative_path.split(os.sep)[0] for relative_path in scorable_paths]
+    unlisted = sorted(set(path_landmarks) - landmark_names) if landmark_names is not None else []
+    if unlisted:
+        logging.warning(f"{len(unlisted)} 個目錄不在景點清單中，直接以目錄名稱作為景點名稱: {', '.join(unlisted)}")
+    landmarks = sorted(set(path_landmarks))
+    landmark_ids = {name: i for i, name in enumerate(landmarks)}
+    landmark_index = np.array([landmark_ids[name] for name in path_landmarks], dtype=np.int64)
+    if scorable_paths:
+        landmark_features = encode_landmarks(model, landmarks, device, args.landmark_template)
+        relevance = relevance_scores(store.get(scorable_paths), landmark_features, landmark_index)
+        cutoffs = relevance_cutoffs(relevance, landmark_index, args.relevance_percentile)
+    else:
+        relevance = cutoffs = np.zeros(0, dtype=np.float32)
+
+    placed_count = 0
+    removed_count = 0
+    face_rejected = 0
+    quality_rejected = 0
+    relevance_rejected = 0
+
+    # 處理每張圖片
+    for relative_path, score, cutoff in zip(scorable_paths, relevance, cutoffs):
+        entry = state['images'][relative_path]
+        # 新增或變動的圖片紀錄已重建，不會帶有先前的 accepted
+        previously_accepted = entry.get('accepted', False)
+
+        has_no_face = entry['face_score'] < args.threshold  # 如果相似度低於閾值，表示沒有明顯人臉
+        is_relevant = bool(score >= cutoff)
+        good_quality = passes_quality(entry['quality'], args.min_sharpness, args.max_clipped,
+                                      args.min_side, args.max_aspect_ratio)
+        accepted = bool(has_no_face and is_relevant and good_quality)
+        face_rejected += not has_no_face
+        relevance_rejected += has_no_face and not is_relevant
+        quality_rejected += has_no_face and is_relevant and not good_quality
+        entry.update(relevance_score=float(score), accepted=accepted)
+
+        img_path = os.path.join(source_dir, relative_path)
+        target_path = os.path.join(target_dir, relative_path)
+        # 以目標檔案是否存在為準：先前輸出失敗或被手動刪除的圖片會重新輸出；manifest 模式只記錄在 manifest
+        needs_placement = mode_changed or not previously_accepted or not os.path.exists(target_path)
+        if accepted and args.output_mode != 'manifest' and needs_placement:
+            try:
+                # 保持原始目錄結構；依輸出模式複製或建立連結
+                place_file(img_path, target_path, args.output_mode)
+                placed_count += 1
+            except Exception as e:
+                logging.error(f"輸出圖片失敗 {img_path}: {str(e)}")
+        elif not accepted and os.path.exists(target_path):
+            # 先前保留、現在不符合條件的圖片
+            os.remove(target_path)
+            removed_count += 1
+
+    # 來源已刪除的圖片也從篩選結果中移除
+    deleted_paths = set(state['images']) - set(signatures)
+    for relative_path in deleted_paths:
+        target_path = os.path.join(target_dir, relative_path)
+        if os.path.exists(target_path):
+            os.remove(target_path)
+            removed_count += 1
+        del state['images'][relative_path]
+
+    state['threshold'] = args.threshold
+    state['prompts'] = args.prompts
+    state['output_mode'] = args.output_mode
+    save_state(state_path, state)
+
+    # 狀態檔已記錄隔離，重跑時不會再次解碼這些圖片，隔離清單因此不會重複
+    quarantine_path = args.quarantine_file or os.path.join(target_dir, 'quarantine.txt')
+    with open(quarantine_path, 'a', encoding='utf-8') as f:
+        for img_path, error in quarantined:
+            f.write(f"{img_path}\t{error}\n")
+
+    # 下游（image_data_json_filter、TWAttractionDataset）可直接讀取 manifest，不需要實體複本
+    accepted_paths = [path for path, entry in state['images'].items() if entry['accepted']]
+    manifest_path = args.manifest or os.path.join(target_dir, 'accepted_images.json')
+    write_manifest(manifest_path, source_dir, accepted_paths)
+    accepted_total = len(accepted_paths)
+    logging.info(f"處理完成！總共 {len(image_paths)} 張圖片：處理 {len(to_score)} 張（新增 {len(new_paths)}、"
+                 f"變動 {len(changed_paths)}），略過 {len(image_paths) - len(to_score)} 張，"
+                 f"來源已刪除 {len(deleted_paths)} 張")
+    logging.info(f"人臉剔除 {face_rejected} 張，與景點無關剔除 {relevance_rejected} 張"
+                 f"（各景點相關度低於第 {args.relevance_percentile:g} 百分位數），"
+                 f"品質不佳剔除 {quality_rejected} 張（模糊、曝光裁切、解析度或長寬比），省下對應的 GPT 描述呼叫")
+    logging.info(f"本次輸出 {placed_count} 張（{args.output_mode}）、移除 {removed_count} 張，目前保留 {accepted_total} 張圖片")
+    logging.info(f"保留清單已寫入 {manifest_path}")
+    if image_paths:
+        logging.info(f"篩選率: {(accepted_total/len(image_paths))*100:.2f}%")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
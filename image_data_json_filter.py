@@ -1,8 +1,10 @@
 import os
 import json
-import shutil
+import argparse
 from tqdm import tqdm
 import logging
+from filter_output import OUTPUT_MODES, place_file, read_manifest, write_manifest
+from record_index import RecordIndex
 
 # 設定logging
 logging.basicConfig(
@@ -10,16 +12,12 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-def process_json_files():
-    # 設定目錄路徑
-    source_dataset_dir = "/media/Pluto/stanley_hsu/TW_attraction/datasets"
-    filtered_images_dir = "/media/Pluto/stanley_hsu/TW_attraction/Small_Filter_Images"
-    target_dataset_dir = "/media/Pluto/stanley_hsu/TW_attraction/Small_Filter_Image_Dataset"
-    
-    # 確保目標目錄存在
-    os.makedirs(target_dataset_dir, exist_ok=True)
-    
-    # 獲取所有過濾後的圖片路徑
+def load_filtered_images(filtered_images_dir, image_manifest=None):
+    """取得過濾後圖片的相對路徑集合；有 manifest 時直接讀取，不需要掃描圖片目錄"""
+    if image_manifest:
+        _, paths = read_manifest(image_manifest)
+        return set(paths)
+
     filtered_images = set()
     for root, _, files in os.walk(filtered_images_dir):
         for file in files:
@@ -27,50 +25,80 @@ def process_json_files():
                 # 獲取相對路徑
                 rel_path = os.path.relpath(os.path.join(root, file), filtered_images_dir)
                 filtered_images.add(rel_path)
-    
+    return filtered_images
+
+def process_json_files(
+    source_dataset_dir="/media/Pluto/stanley_hsu/TW_attraction/datasets",
+    filtered_images_dir="/media/Pluto/stanley_hsu/TW_attraction/Small_Filter_Images",
+    target_dataset_dir="/media/Pluto/stanley_hsu/TW_attraction/Small_Filter_Image_Dataset",
+    image_manifest=None,
+    output_mode='copy',
+    output_manifest=None,
+    workers=8,
+    rebuild_index=False
+):
+    # 確保目標目錄存在
+    os.makedirs(target_dataset_dir, exist_ok=True)
+
+    # 獲取所有過濾後的圖片路徑
+    filtered_images = load_filtered_images(filtered_images_dir, image_manifest)
+
     logging.info(f"找到 {len(filtered_images)} 張過濾後的圖片")
-    
-    # 計數器
-    total_json = 0
+
+    # 以 (景點, 圖片) → record 的索引做集合交集，不需要解析每一個 record
+    index = RecordIndex(source_dataset_dir)
+    if rebuild_index:
+        index.rebuild(workers)
+    parsed, removed = index.refresh(workers)
+    logging.info(f"record 索引共 {len(index)} 筆（新解析 {parsed} 筆、移除 {removed} 筆）")
+
+    total_json = len(index)
     copied_json = 0
-    
-    # 遍歷所有json檔案
-    for root, _, files in os.walk(source_dataset_dir):
-        for file in files:
-            if file.endswith('.json'):
-                total_json += 1
-                json_path = os.path.join(root, file)
-                
-                try:
-                    with open(json_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                    
-                    # 檢查image_path是否存在於過濾後的圖片中
-                    landmark_name = data.get('landmark_name', '')
-                    image_path = data.get('image_path', '')
-                    
-                    if landmark_name and image_path:
-                        full_image_path = os.path.join(landmark_name, image_path)
-                        
-                        if full_image_path in filtered_images:
-                            # 創建目標目錄（保持相同的目錄結構）
-                            rel_path = os.path.relpath(json_path, source_dataset_dir)
-                            target_path = os.path.join(target_dataset_dir, rel_path)
-                            os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                            
-                            # 複製json檔案
-                            shutil.copy2(json_path, target_path)
-                            copied_json += 1
-                            
-                            if copied_json % 100 == 0:
-                                logging.info(f"已處理 {copied_json} 個符合條件的JSON檔案")
-                    
-                except Exception as e:
-                    logging.error(f"處理JSON檔案時發生錯誤 {json_path}: {str(e)}")
-    
+    accepted_records = []
+
+    for rel_path in index.join(filtered_images):
+        json_path = os.path.join(source_dataset_dir, rel_path)
+        # 保持相同的目錄結構
+        target_path = os.path.join(target_dataset_dir, rel_path)
+
+        try:
+            # 依輸出模式複製、建立連結，或只記錄在 manifest
+            place_file(json_path, target_path, output_mode)
+            accepted_records.append(rel_path)
+            copied_json += 1
+
+            if copied_json % 100 == 0:
+                logging.info(f"已處理 {copied_json} 個符合條件的JSON檔案")
+
+        except Exception as e:
+            logging.error(f"處理JSON檔案時發生錯誤 {json_path}: {str(e)}")
+
+    # TWAttractionDataset 可直接讀取這份 manifest
+    manifest_path = output_manifest or os.path.join(target_dataset_dir, 'accepted_records.json')
+    write_manifest(manifest_path, source_dataset_dir, accepted_records)
+
     logging.info(f"處理完成！總共掃描了 {total_json} 個JSON檔案")
-    logging.info(f"複製了 {copied_json} 個符合條件的JSON檔案")
-    logging.info(f"篩選率: {(copied_json/total_json)*100:.2f}%")
+    logging.info(f"輸出了 {copied_json} 個符合條件的JSON檔案（{output_mode}），清單已寫入 {manifest_path}")
+    if total_json:
+        logging.info(f"篩選率: {(copied_json/total_json)*100:.2f}%")
 
 if __name__ == "__main__":
-    process_json_files()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Keep generated records whose image passed the image filter.')
+    parser.add_argument('--image-manifest', type=str, default=None,
+                        help='accepted_images.json written by image_data_filter (instead of scanning the image dir)')
+    parser.add_argument('--output-mode', type=str, choices=OUTPUT_MODES, default='copy')
+    parser.add_argument('--output-manifest', type=str, default=None,
+                        help='Manifest of accepted records (default: <target dir>/accepted_records.json)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Processes used to parse records missing from the record index')
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help='Re-parse every record instead of reusing the record index')
+    args = parser.parse_args()
+
+    process_json_files(
+        image_manifest=args.image_manifest,
+        output_mode=args.output_mode,
+        output_manifest=args.output_manifest,
+        workers=args.workers,
+        rebuild_index=args.rebuild_index
+    )
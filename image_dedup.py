@@ -0,0 +1,140 @@
+import os
+import json
+import argparse
+import logging
+from collections import defaultdict
+import numpy as np
+from tqdm import tqdm
+from clip_embedding_store import EmbeddingStore
+from filter_output import read_manifest
+
+# 設定logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def find_clusters(features, threshold=0.95, block_size=1024):
+    """
+    以分塊的全配對 cosine similarity 找出近似重複的圖片群組。
+    每次只計算 block_size 列與全部圖片的相似度矩陣，記憶體用量為 O(block_size * n)。
+    回傳每張圖片所屬群組的編號（以群組內最小的索引表示）。
+    """
+    n = len(features)
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for start in range(0, n, block_size):
+        similarity = features[start:start + block_size] @ features.T
+        rows, cols = np.nonzero(similarity >= threshold)
+        rows += start
+        # 相似度矩陣對稱，只需處理上三角
+        for i, j in zip(rows[rows < cols], cols[rows < cols]):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    return np.array([find(i) for i in range(n)])
+
+
+def pick_representatives(features, members, keep=1):
+    """保留群組中最具代表性（與其他成員平均相似度最高）的 keep 張圖片"""
+    if len(members) <= keep:
+        return list(members)
+    centrality = (features[members] @ features[members].T).mean(axis=-1)
+    return [members[i] for i in np.argsort(-centrality, kind='stable')[:keep]]
+
+
+def cluster_landmark(store, paths, threshold=0.95, keep=1, block_size=1024):
+    """對單一景點的圖片分群，回傳 [{'representatives': [...], 'members': [...]}]（依第一個成員排序）"""
+    paths = sorted(paths)
+    features = store.get(paths)
+    labels = find_clusters(features, threshold, block_size)
+
+    groups = defaultdict(list)
+    for i, label in enumerate(labels):
+        groups[label].append(i)
+
+    clusters = []
+    for label in sorted(groups):
+        members = groups[label]
+        representatives = pick_representatives(features, members, keep)
+        clusters.append({
+            'representatives': sorted(paths[i] for i in representatives),
+            'members': [paths[i] for i in members]
+        })
+    return clusters
+
+
+def write_cluster_manifest(path, source_dir, clusters, threshold, keep):
+    """
+    寫入群組 manifest。'paths' 為保留下來的代表圖片，格式與 filter_output 的 manifest 相容，
+    下游可直接當成過濾後的圖片清單使用。
+    """
+    paths = [p for landmark_clusters in clusters.values() for c in landmark_clusters for p in c['representatives']]
+    tmp_path = f"{path}.part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'source_dir': source_dir,
+            'threshold': threshold,
+            'keep': keep,
+            'paths': sorted(paths),
+            'clusters': clusters
+        }, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate landmark images by CLIP cosine similarity.')
+    parser.add_argument('--image-manifest', type=str,
+                        default="/media/Pluto/stanley_hsu/TW_attraction/Small_Filter_Images/accepted_images.json",
+                        help='accepted_images.json written by image_data_filter')
+    parser.add_argument('--store-dir', type=str,
+                        default="/media/Pluto/stanley_hsu/TW_attraction/clip_embeddings",
+                        help='Directory of the persisted CLIP image embedding store')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Cluster manifest (default: <image manifest dir>/image_clusters.json)')
+    parser.add_argument('--threshold', type=float, default=0.95,
+                        help='Images whose cosine similarity is at least this value are near-duplicates')
+    parser.add_argument('--keep', type=int, default=1,
+                        help='Representatives kept per cluster')
+    parser.add_argument('--block-size', type=int, default=1024,
+                        help='Rows of the similarity matrix computed at once')
+    args = parser.parse_args()
+
+    source_dir, paths = read_manifest(args.image_manifest)
+    store = EmbeddingStore(args.store_dir)
+
+    missing = store.missing(paths)
+    if missing:
+        logging.warning(f"{len(missing)} 張圖片不在 embedding store 中，略過（請先執行 image_data_filter）")
+    missing = set(missing)
+
+    landmark_paths = defaultdict(list)
+    for path in paths:
+        if path not in missing:
+            landmark_paths[path.split(os.sep)[0]].append(path)
+
+    clusters = {}
+    for landmark, landmark_images in tqdm(sorted(landmark_paths.items())):
+        clusters[landmark] = cluster_landmark(store, landmark_images, args.threshold, args.keep, args.block_size)
+
+    output_path = args.output or os.path.join(os.path.dirname(args.image_manifest), 'image_clusters.json')
+    write_cluster_manifest(output_path, source_dir, clusters, args.threshold, args.keep)
+
+    image_count = sum(len(v) for v in landmark_paths.values())
+    cluster_count = sum(len(v) for v in clusters.values())
+    kept_count = sum(len(c['representatives']) for v in clusters.values() for c in v)
+    logging.info(f"處理完成！{len(clusters)} 個景點共 {image_count} 張圖片，分成 {cluster_count} 個群組")
+    logging.info(f"保留 {kept_count} 張代表圖片，省下 {image_count - kept_count} 張圖片的 GPT 描述與對話呼叫")
+    logging.info(f"群組清單已寫入 {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import os
+import io
+import math
+import base64
+import hashlib
+from collections import namedtuple
+from PIL import Image, ImageOps
+from download_engine import atomic_write
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_cache')
+
+# OpenAI 影像 token 計算：(基本 token, 每個 512px tile 的 token)
+IMAGE_TOKEN_COSTS = {
+    'gpt-4o': (85, 170),
+    'gpt-4o-mini': (2833, 5667),
+}
+TILE_SIZE = 512
+MAX_SIDE = 2048
+MAX_SHORT_SIDE = 768
+LOW_DETAIL_SIDE = 512
+# EXIF Orientation 為 5–8 時，影像需轉 90 度才是正確方向
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+PreparedImage = namedtuple('PreparedImage', [
+    'b64', 'detail', 'width', 'height', 'tokens', 'bytes',
+    'original_width', 'original_height', 'original_tokens', 'original_bytes'
+])
+
+
+def api_size(width: int, height: int):
+    """Size the API actually tiles: fit in 2048x2048, then shorten the short side to 768."""
+    scale = min(1.0, MAX_SIDE / max(width, height), MAX_SHORT_SIDE / min(width, height))
+    return width * scale, height * scale
+
+
+def image_tokens(width: int, height: int, detail: str = 'high', model: str = 'gpt-4o') -> int:
+    """Image input tokens of a ``width`` x ``height`` image for ``model``."""
+    base, per_tile = IMAGE_TOKEN_COSTS.get(model, IMAGE_TOKEN_COSTS['gpt-4o'])
+    if detail == 'low':
+        return base
+    width, height = api_size(width, height)
+    return base + per_tile * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def target_size(width: int, height: int, min_short_side: int = 512, detail: str = 'high'):
+    """
+    Upload size with the fewest 512px tiles whose short side is still at least
+    ``min_short_side``; within that tile layout the largest size is kept.
+    The image is never enlarged.
+    """
+    if detail == 'low':
+        scale = min(1.0, LOW_DETAIL_SIDE / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    api_width, api_height = api_size(width, height)
+    scale = min(1.0, min_short_side / min(api_width, api_height))
+    # 找出此縮放下的 tile 數，再把尺寸放大到同一個 tile 配置能容納的最大值
+    tiles_x = math.ceil(api_width * scale / TILE_SIZE)
+    tiles_y = math.ceil(api_height * scale / TILE_SIZE)
+    scale = min(1.0, TILE_SIZE * tiles_x / api_width, TILE_SIZE * tiles_y / api_height)
+    return max(1, math.floor(api_width * scale)), max(1, math.floor(api_height * scale))
+
+
+def image_usage(prepared: PreparedImage) -> dict:
+    """Image token fields recorded next to the text token usage of a request."""
+    return {'image_tokens': prepared.tokens, 'original_image_tokens': prepared.original_tokens}
+
+
+class ImagePreparer:
+    """Resize and re-encode images for upload, caching the payload by content hash.
+
+    The prepared JPEG is stored as ``{cache_dir}/{sha256(file + settings)}.jpg`` so an
+    image is only decoded and resized once for a given set of settings.
+    ``cache_dir=None`` disables the cache.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, min_short_side: int = 512, quality: int = 85,
+                 detail: str = 'high', model: str = 'gpt-4o'):
+        self.cache_dir = cache_dir
+        self.min_short_side = min_short_side
+        self.quality = quality
+        self.detail = detail
+        self.model = model
+
+    def _key(self, data: bytes) -> str:
+        digest = hashlib.sha256(data)
+        digest.update(f"{self.min_short_side}:{self.quality}:{self.detail}:exif".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _encode(self, image: Image.Image) -> bytes:
+        # 依 EXIF 方向轉正後再上傳；尺寸以轉正後的方向計算
+        transposed = image.getexif().get(EXIF_ORIENTATION) in TRANSPOSED_ORIENTATIONS
+        width, height = image.size[::-1] if transposed else image.size
+        width, height = target_size(width, height, min_short_side=self.min_short_side, detail=self.detail)
+        # JPEG 直接以縮小的尺寸解碼（draft 使用檔案中儲存的方向）
+        image.draft('RGB', (height, width) if transposed else (width, height))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        if image.size != (width, height):
+            image = image.resize((width, height), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=self.quality, optimize=True)
+        return buffer.getvalue()
+
+    def prepare(self, image_path: str) -> PreparedImage:
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        original = Image.open(io.BytesIO(data))
+        original_width, original_height = original.size
+
+        cache_path = os.path.join(self.cache_dir, f"{self._key(data)}.jpg") if self.cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                prepared = f.read()
+        else:
+            prepared = self._encode(original)
+            if cache_path:
+                atomic_write(cache_path, prepared)
+
+        width, height = Image.open(io.BytesIO(prepared)).size
+        return PreparedImage(
+            b64=base64.b64encode(prepared).decode('utf-8'),
+            detail=self.detail,
+            width=width,
+            height=height,
+            tokens=image_tokens(width, height, self.detail, self.model),
+            bytes=len(prepared),
+            original_width=original_width,
+            original_height=original_height,
+            original_tokens=image_tokens(original_width, original_height, 'high', self.model),
+            original_bytes=len(data)
+        )
+
+    def image_content(self, prepared: PreparedImage) -> dict:
+        """Chat-completions ``image_url`` content part of a prepared image."""
+        return {
+            "type": "image_url",
+            "image_url": {"url": f"data:image/jpeg;base64,{prepared.b64}", "detail": prepared.detail}
+        }
@@ -0,0 +1,319 @@
+import io
+import re
+import time
+import base64
+import random
+import asyncio
+import threading
+from typing import Dict, Optional, Tuple
+import openai
+from PIL import Image
+from image_prep import MAX_SIDE, image_tokens
+
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+# 沒有 reset 標頭時假設一分鐘的額度視窗
+DEFAULT_WINDOW = 60.0
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Seconds of an ``x-ratelimit-reset-*`` value such as ``"20ms"``, ``"1.5s"`` or ``"6m0s"``."""
+    parts = DURATION_PART.findall(value or '')
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_SECONDS[unit] for number, unit in parts)
+
+
+def image_part_tokens(part: Dict, model: str) -> int:
+    """Image tokens of an ``image_url`` content part; the size is read from a data URL's header."""
+    image_url = part.get('image_url') or {}
+    detail = image_url.get('detail', 'auto')
+    if detail == 'low':
+        return image_tokens(1, 1, 'low', model)
+    url = image_url.get('url', '')
+    try:
+        width, height = Image.open(io.BytesIO(base64.b64decode(url.split(',', 1)[1]))).size
+    except Exception:
+        # 遠端網址或無法解析時以最大尺寸估計
+        width = height = MAX_SIDE
+    return image_tokens(width, height, 'high', model)
+
+
+def estimate_tokens(request: Dict) -> int:
+    """
+    Rate-limit tokens of a request as counted by the provider: prompt text, images
+    (512px tiles) plus ``max_tokens``. Chinese text is about one token per character,
+    so the character count is used for the prompt.
+    """
+    tokens = 0
+    for message in request.get('messages', []):
+        content = message.get('content') or ''
+        if isinstance(content, str):
+            tokens += len(content)
+            continue
+        for part in content:
+            if part.get('type') == 'image_url':
+                tokens += image_part_tokens(part, request.get('model', ''))
+            else:
+                tokens += len(part.get('text', ''))
+    return tokens + (request.get('max_tokens') or 0)
+
+
+def is_retryable(exc: Exception) -> bool:
+    # 額度用盡（insufficient_quota）同樣回傳 429，但重試不會恢復
+    if isinstance(exc, openai.RateLimitError):
+        return getattr(exc, 'code', None) != 'insufficient_quota'
+    if isinstance(exc, openai.APIConnectionError):
+        return True
+    return isinstance(exc, openai.APIStatusError) and (exc.status_code in (408, 409) or exc.status_code >= 500)
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, 'response', None)
+    if response is None:
+        return None
+    try:
+        if response.headers.get('retry-after-ms'):
+            return float(response.headers['retry-after-ms']) / 1000
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class Budget:
+    """One rate-limit dimension (requests or tokens) of a model, synced from response headers.
+
+    Between responses the budget refills at the rate implied by the last headers
+    (used capacity over the time until reset), is full again once the reset time has
+    passed and is drawn down by every request sent.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.rate = 0.0
+        self.window = DEFAULT_WINDOW
+        self.updated = time.monotonic()
+        self.reset_at = self.updated
+
+    def sync(self, limit: str, remaining: str, reset: str):
+        try:
+            limit, remaining = float(limit), float(remaining)
+        except (TypeError, ValueError):
+            return
+        reset = parse_duration(reset)
+        self.limit = limit
+        self.remaining = remaining
+        self.window = reset if reset is not None else DEFAULT_WINDOW
+        self.rate = (limit - remaining) / self.window if self.window > 0 else 0.0
+        self.updated = time.monotonic()
+        self.reset_at = self.updated + self.window
+
+    def available(self, now: float) -> float:
+        if self.remaining is None:
+            return float('inf')
+        if now >= self.reset_at:
+            return self.limit
+        return min(self.limit, self.remaining + self.rate * (now - self.updated))
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` is available (0 when it already is), at most until the reset."""
+        available = self.available(now)
+        if available >= min(amount, self.limit or amount):
+            return 0.0
+        until_reset = self.reset_at - now
+        if self.rate > 0:
+            return min((amount - available) / self.rate, until_reset)
+        return until_reset
+
+    def take(self, amount: float, now: float):
+        if self.remaining is not None:
+            self.remaining = self.available(now) - amount
+            if now >= self.reset_at:
+                # 視窗已重置，下一個視窗從現在開始
+                self.reset_at = now + self.window
+            self.updated = now
+
+
+class ModelBudget:
+    """Request and token budgets of one model, from the ``x-ratelimit-*`` headers."""
+
+    def __init__(self):
+        self.requests = Budget()
+        self.tokens = Budget()
+        self._lock = threading.Lock()
+
+    def update(self, headers):
+        with self._lock:
+            self.requests.sync(headers.get('x-ratelimit-limit-requests'), headers.get('x-ratelimit-remaining-requests'),
+                               headers.get('x-ratelimit-reset-requests'))
+            self.tokens.sync(headers.get('x-ratelimit-limit-tokens'), headers.get('x-ratelimit-remaining-tokens'),
+                             headers.get('x-ratelimit-reset-tokens'))
+
+    def reserve(self, tokens: int) -> float:
+        """Take one request and ``tokens`` from the budget, or return how long to wait first."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait == 0:
+                self.requests.take(1, now)
+                self.tokens.take(tokens, now)
+            return wait
+
+
+class OpenAIScheduler:
+    """
+    Shared scheduler of chat-completions calls: per-model request/token budgets,
+    AIMD concurrency and retries with jittered exponential backoff.
+
+    The concurrency limit grows by one per limit's worth of successful calls (additive
+    increase) and is halved on a 429 (multiplicative decrease, at most once per
+    ``decrease_interval``), between 1 and ``max_concurrency``. Before a call is sent the
+    model's budget, synced from the ``x-ratelimit-*`` headers of every response, must
+    cover one request and the estimated tokens. 429s (except ``insufficient_quota``),
+    5xx and connection errors are retried up to ``max_retries`` times; ``Retry-After``
+    is a lower bound of the delay.
+    ``call`` is for ``OpenAI`` clients (threads), ``acall`` for ``AsyncOpenAI`` clients.
+    """
+
+    def __init__(self, max_concurrency: int = 16, initial_concurrency: Optional[int] = None, max_retries: int = 10,
+                 base_delay: float = 1.0, max_delay: float = 60.0, decrease_interval: float = 5.0):
+        self.max_concurrency = max_concurrency
+        self.limit = float(initial_concurrency or max(1, max_concurrency // 2))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.decrease_interval = decrease_interval
+        self.budgets: Dict[str, ModelBudget] = {}
+        self.inflight = 0
+        self.last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._async_condition = None
+
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.budget_wait_seconds = 0.0
+
+    def budget(self, model: str) -> ModelBudget:
+        with self._lock:
+            if model not in self.budgets:
+                self.budgets[model] = ModelBudget()
+            return self.budgets[model]
+
+    def _on_success(self):
+        with self._lock:
+            self.requests += 1
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def _on_error(self, exc: Exception):
+        with self._lock:
+            if isinstance(exc, openai.RateLimitError):
+                self.throttled += 1
+                now = time.monotonic()
+                if now - self.last_decrease >= self.decrease_interval:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+
+    def _retry_delay(self, exc: Exception, attempt: int) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        after = retry_after(exc)
+        if after is not None:
+            delay = max(delay, after)
+        with self._lock:
+            self.retries += 1
+        return delay
+
+    def _budget_wait(self, model: str, tokens: int) -> float:
+        wait = self.budget(model).reserve(tokens)
+        if wait:
+            with self._lock:
+                self.budget_wait_seconds += wait
+        return wait
+
+    def _update_budget(self, model: str, headers):
+        if headers is not None:
+            self.budget(model).update(headers)
+
+    def call(self, client, request: Dict) -> Tuple[object, float]:
+        """Send ``request`` with ``client``; returns the response and the latency of the successful attempt."""
+        # 重試由排程器負責，關閉 client 自己的重試
+        create = client.with_options(max_retries=0).chat.completions.with_raw_response.create
+        model = request['model']
+        tokens = estimate_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            with self._condition:
+                while self.inflight >= int(self.limit):
+                    self._condition.wait()
+                self.inflight += 1
+            try:
+                while True:
+                    wait = self._budget_wait(model, tokens)
+                    if not wait:
+                        break
+                    time.sleep(wait)
+                start = time.time()
+                raw = create(**request)
+                latency = time.time() - start
+            except Exception as e:
+                self._update_budget(model, getattr(getattr(e, 'response', None), 'headers', None))
+                self._on_error(e)
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._retry_delay(e, attempt)
+            else:
+                self._update_budget(model, raw.headers)
+                self._on_success()
+                return raw.parse(), latency
+            finally:
+                with self._condition:
+                    self.inflight -= 1
+                    self._condition.notify_all()
+            time.sleep(delay)
+
+    async def acall(self, async_client, request: Dict) -> Tuple[object, float]:
+        """Async ``call`` for an ``AsyncOpenAI`` client."""
+        if self._async_condition is None:
+            self._async_condition = asyncio.Condition()
+        condition = self._async_condition
+        create = async_client.with_options(max_retries=0).chat.completions.with_raw_response.create
+        model = request['model']
+        tokens = estimate_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            async with condition:
+                await condition.wait_for(lambda: self.inflight < int(self.limit))
+                self.inflight += 1
+            try:
+                while True:
+                    wait = self._budget_wait(model, tokens)
+                    if not wait:
+                        break
+                    await asyncio.sleep(wait)
+                start = time.time()
+                raw = await create(**request)
+                latency = time.time() - start
+            except Exception as e:
+                self._update_budget(model, getattr(getattr(e, 'response', None), 'headers', None))
+                self._on_error(e)
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = self._retry_delay(e, attempt)
+            else:
+                self._update_budget(model, raw.headers)
+                self._on_success()
+                return raw.parse(), latency
+            finally:
+                async with condition:
+                    self.inflight -= 1
+                    condition.notify_all()
+            await asyncio.sleep(delay)
+
+    def metrics(self) -> dict:
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'concurrency_limit': round(self.limit, 2),
+            'budget_wait_seconds': round(self.budget_wait_seconds, 2)
+        }
@@ -0,0 +1,47 @@
+import os
+import json
+import threading
+from download_engine import atomic_write
+
+
+class PhotoIndex:
+    """Run-wide index of Flickr photo ids and image content hashes.
+
+    Overlapping queries ("淡水" / "淡水老街") return the same photos; the index
+    remembers which landmark first downloaded each photo id and which file first
+    stored each SHA-256, so later landmarks can skip them.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.ids = {}
+        self.hashes = {}
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.ids = data.get('ids', {})
+            self.hashes = data.get('hashes', {})
+
+    def claim_id(self, photo_id: str, owner: str) -> bool:
+        """Record ``photo_id`` for ``owner``; False if another landmark already has it."""
+        if photo_id is None:
+            return True
+        with self._lock:
+            return self.ids.setdefault(photo_id, owner) == owner
+
+    def claim_hash(self, digest: str, location: str) -> bool:
+        """
+        Record ``digest`` for ``location`` (a file, or a photo when file names are not
+        stable across runs); False if another location already has the same bytes.
+        """
+        with self._lock:
+            return self.hashes.setdefault(digest, location) == location
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps({'ids': self.ids, 'hashes': self.hashes}, ensure_ascii=False)
+        atomic_write(self.path, data.encode('utf-8'))
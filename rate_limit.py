@@ -0,0 +1,125 @@
+import re
+import time
+import random
+import threading
+import urllib.error
+import requests
+
+
+class TokenBucket:
+    """Thread-safe token bucket with wait/retry metrics.
+
+    ``rate`` tokens are added per second up to ``capacity``; ``acquire`` blocks
+    until a token is available.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float = None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.started = time.monotonic()
+        self.requests = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.retries = 0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.requests += 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+                self.waits += 1
+                self.wait_seconds += delay
+            time.sleep(delay)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    @property
+    def requests_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.requests / elapsed if elapsed > 0 else 0.0
+
+    def metrics(self) -> dict:
+        return {
+            'requests': self.requests,
+            'waits': self.waits,
+            'wait_seconds': round(self.wait_seconds, 2),
+            'retries': self.retries,
+            'requests_per_second': round(self.requests_per_second, 2)
+        }
+
+
+# Flickr allows 3600 API calls per key per hour; the image CDN is far more generous.
+API_LIMITER = TokenBucket('api', rate=1.0, capacity=5)
+IMAGE_LIMITER = TokenBucket('image', rate=20.0, capacity=40)
+
+
+def _status_code(exc: Exception):
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code
+    response = getattr(exc, 'response', None)
+    if response is not None:
+        return response.status_code
+    # flickrapi only reports HTTP failures in the message: "do_request: Status code 429 received"
+    match = re.search(r'Status code (\d+)', str(exc))
+    return int(match.group(1)) if match else None
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+        return True
+    # urlretrieve 的連線失敗（HTTPError 以外的 URLError，例如 DNS 失敗、連線被重置）
+    if isinstance(exc, urllib.error.URLError) and not isinstance(exc, urllib.error.HTTPError):
+        return True
+    status = _status_code(exc)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _retry_after(exc: Exception):
+    # requests 的例外把標頭放在 response 上，urllib 的 HTTPError 則是 exc.headers
+    response = getattr(exc, 'response', None)
+    headers = response.headers if response is not None else getattr(exc, 'headers', None)
+    if headers is None:
+        return None
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retry(bucket: TokenBucket, fn, *args, max_retries: int = 5,
+                    base_delay: float = 1.0, max_delay: float = 60.0, **kwargs):
+    """Call ``fn`` under ``bucket``, retrying 429/5xx and connection errors.
+
+    Backoff is exponential with full jitter; a ``Retry-After`` header, when
+    present, is used as the lower bound.
+    """
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            bucket.record_retry()
+            time.sleep(delay)
+
+
+def report() -> str:
+    return '\n'.join(f"{bucket.name}: {bucket.metrics()}" for bucket in (API_LIMITER, IMAGE_LIMITER))
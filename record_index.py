@@ -0,0 +1,148 @@
+import os
+import json
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+INDEX_FILENAME = '_record_index.jsonl'
+
+
+def _read_keys(dataset_dir: str, records: List[str]) -> List[Tuple[str, str, str]]:
+    """Parse a chunk of records and return ``(record, landmark_name, image_path)`` for each readable one."""
+    entries = []
+    for record in records:
+        try:
+            with open(os.path.join(dataset_dir, record), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries.append((record, data.get('landmark_name', ''), data.get('image_path', '')))
+        except Exception as e:
+            logging.error(f"處理JSON檔案時發生錯誤 {record}: {str(e)}")
+    return entries
+
+
+class RecordIndex:
+    """
+    Persistent ``(landmark_name, image_path) -> record files`` index of a generated dataset.
+
+    The index is a JSON Lines file next to the records. Writers append one line per
+    record (``add``), or replace the records of the same image written under an older
+    generator config (``supersede``); ``refresh`` lists the dataset directory, parses
+    only records the index does not know about yet (in parallel) and drops entries
+    whose file is gone, so records written without the index are picked up on the
+    next refresh.
+    """
+
+    def __init__(self, dataset_dir: str, path: Optional[str] = None):
+        self.dataset_dir = dataset_dir
+        self.path = path or os.path.join(dataset_dir, INDEX_FILENAME)
+        self.records: Dict[str, Tuple[str, str]] = {}
+        # (景點, 圖片) → record 集合，supersede 第一次使用時才建立
+        self._image_records: Optional[Dict[Tuple[str, str], Set[str]]] = None
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 寫入中斷留下的半行，refresh 時會重新解析該 record
+                        continue
+                    self.records[entry['record']] = (entry['landmark_name'], entry['image_path'])
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def add(self, record_path: str, landmark_name: str, image_path: str):
+        """Append a newly written record; ``record_path`` is the path the record was written to."""
+        record = os.path.relpath(record_path, self.dataset_dir)
+        self.records[record] = (landmark_name, image_path)
+        if self._image_records is not None:
+            self._image_records[(landmark_name, image_path)].add(record)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'record': record, 'landmark_name': landmark_name, 'image_path': image_path},
+                               ensure_ascii=False) + '\n')
+
+    def supersede(self, record_path: str, landmark_name: str, image_path: str) -> List[str]:
+        """
+        Add a newly written record and delete the other records of the same image
+        (written under an older generator config). Returns the deleted records.
+        """
+        if self._image_records is None:
+            self._image_records = defaultdict(set)
+            for other, key in self.records.items():
+                self._image_records[key].add(other)
+        record = os.path.relpath(record_path, self.dataset_dir)
+        stale = sorted(self._image_records[(landmark_name, image_path)] - {record})
+        if not stale:
+            self.add(record_path, landmark_name, image_path)
+            return []
+        for other in stale:
+            try:
+                os.remove(os.path.join(self.dataset_dir, other))
+            except FileNotFoundError:
+                pass
+            del self.records[other]
+        self.records[record] = (landmark_name, image_path)
+        self._image_records[(landmark_name, image_path)] = {record}
+        self.save()
+        return stale
+
+    def _list_records(self) -> List[str]:
+        records = []
+        for root, _, files in os.walk(self.dataset_dir):
+            for file in files:
+                if file.endswith('.json'):
+                    records.append(os.path.relpath(os.path.join(root, file), self.dataset_dir))
+        return records
+
+    def refresh(self, workers: int = 8, chunk_size: int = 1000) -> Tuple[int, int]:
+        """Index unknown records and forget deleted ones. Returns ``(parsed, removed)``."""
+        on_disk = set(self._list_records())
+        removed = set(self.records) - on_disk
+        for record in removed:
+            del self.records[record]
+
+        unknown = sorted(on_disk - set(self.records))
+        chunks = [unknown[i:i + chunk_size] for i in range(0, len(unknown), chunk_size)]
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_read_keys, [self.dataset_dir] * len(chunks), chunks))
+        else:
+            results = [_read_keys(self.dataset_dir, chunk) for chunk in chunks]
+        for entries in results:
+            for record, landmark_name, image_path in entries:
+                self.records[record] = (landmark_name, image_path)
+
+        self._image_records = None
+        if unknown or removed:
+            self.save()
+        return len(unknown), len(removed)
+
+    def rebuild(self, workers: int = 8) -> int:
+        """Discard the index and parse every record again."""
+        self.records = {}
+        parsed, _ = self.refresh(workers)
+        self.save()
+        return parsed
+
+    def save(self):
+        tmp_path = f"{self.path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record, (landmark_name, image_path) in sorted(self.records.items()):
+                f.write(json.dumps({'record': record, 'landmark_name': landmark_name, 'image_path': image_path},
+                                   ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def by_image(self) -> Dict[str, List[str]]:
+        """Group record files by ``landmark_name/image_path`` (the filter manifest's relative path)."""
+        images = defaultdict(list)
+        for record, (landmark_name, image_path) in self.records.items():
+            if landmark_name and image_path:
+                images[os.path.join(landmark_name, image_path)].append(record)
+        return images
+
+    def join(self, image_paths: Iterable[str]) -> List[str]:
+        """Record files whose image is in ``image_paths``; no record is opened."""
+        images = self.by_image()
+        return sorted(record for path in set(image_paths) & set(images) for record in images[path])
@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from openai.types.chat import ChatCompletion
+from download_engine import atomic_write
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'response_cache')
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class ResponseCacheMiss(KeyError):
+    """A request was not in the cache while the cache is in replay-only mode."""
+
+
+def request_key(request: Dict) -> str:
+    """
+    Hash of a chat-completions request: model, messages (including the base64 image
+    payloads, i.e. the image bytes) and every sampling parameter.
+    """
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded on-disk cache of chat-completions responses keyed by ``request_key``.
+
+    Responses are stored as ``{cache_dir}/{key[:2]}/{key}.json``. When the cache grows
+    past ``max_bytes`` the least recently used responses are evicted (a hit refreshes
+    the file's mtime, which orders the entries across runs). With ``replay_only=True``
+    no request is sent and a miss raises ``ResponseCacheMiss``.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 replay_only: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.replay_only = replay_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sizes = self._scan()
+        self._total = sum(self._sizes.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _scan(self) -> "OrderedDict[str, int]":
+        """Existing entries, least recently used first."""
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for file in files:
+                    if file.endswith('.json'):
+                        stat = os.stat(os.path.join(root, file))
+                        entries.append((stat.st_mtime, file[:-len('.json')], stat.st_size))
+        return OrderedDict((key, size) for _, key, size in sorted(entries))
+
+    def get(self, request: Dict) -> Optional[ChatCompletion]:
+        key = request_key(request)
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        os.utime(path)
+        return ChatCompletion.model_validate(data)
+
+    def put(self, request: Dict, response: ChatCompletion):
+        key = request_key(request)
+        data = json.dumps(response.model_dump(mode='json'), ensure_ascii=False).encode('utf-8')
+        atomic_write(self._path(key), data)
+        with self._lock:
+            self._total += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            evicted = []
+            while self._total > self.max_bytes and len(self._sizes) > 1:
+                old_key, size = self._sizes.popitem(last=False)
+                self._total -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def lookup(self, request: Dict) -> Optional[ChatCompletion]:
+        """Cached response of ``request``; ``None`` on a miss unless in replay-only mode."""
+        response = self.get(request)
+        if response is not None:
+            self.hits += 1
+            return response
+        self.misses += 1
+        if self.replay_only:
+            raise ResponseCacheMiss(f"request {request_key(request)} ({request.get('model')}) is not in {self.cache_dir}")
+        return None
+
+    def create(self, client, **request) -> ChatCompletion:
+        """``client.chat.completions.create(**request)`` served from the cache when possible."""
+        response = self.lookup(request)
+        if response is None:
+            response = client.chat.completions.create(**request)
+            self.put(request, response)
+        return response
@@ -2,8 +2,11 @@ import flickrapi
 from urllib.request import urlretrieve
 import os
 import json
+import hashlib
 from tqdm import tqdm
 from dotenv import load_dotenv
+from photo_index import PhotoIndex
+from rate_limit import API_LIMITER, IMAGE_LIMITER, call_with_retry
 
 load_dotenv()
 
@@ -11,20 +14,28 @@ KEY = os.getenv('FLICKER_API_KEY')
 SECRET = os.getenv('FLICKER_API_SECRET')
 
 
-def download_images(searchword, limitnum=50):
-    flickr = flickrapi.FlickrAPI(
-        api_key=KEY, secret=SECRET, format='parsed-json')
+def create_client():
+    return flickrapi.FlickrAPI(api_key=KEY, secret=SECRET, format='parsed-json')
+
+
+def download_images(searchword, limitnum=50, index=None, flickr=None):
+    # 所有景點共用同一個 client，避免每個景點重新建立連線
+    if flickr is None:
+        flickr = create_client()
+    if index is None:
+        index = PhotoIndex()
 
     os.makedirs(f'/media/Pluto/stanley_hsu/TW_attraction/images/{searchword}', exist_ok=True)
 
     page = 1
     photos_downloaded = 0
+    duplicates = 0
 
     with tqdm(total=limitnum, desc=f"Downloading {searchword} images") as pbar:
         while photos_downloaded < limitnum:
             try:
-                photos = flickr.photos.search(
-                    text=searchword, extras='url_c', per_page=500, page=page, sort='relevance')
+                photos = call_with_retry(
+                    API_LIMITER, flickr.photos.search, text=searchword, extras='url_c', per_page=500, page=page, sort='relevance')
 
                 if not photos['photos']['photo']:
                     print(f"No more photos found for {searchword}")
@@ -37,8 +48,18 @@ def download_images(searchword, limitnum=50):
                     try:
                         url = photo.get('url_c')
                         if url:
+                            if not index.claim_id(photo['id'], searchword):
+                                duplicates += 1
+                                continue
                             filename = f"/media/Pluto/stanley_hsu/TW_attraction/images/{searchword}/{searchword}-{photos_downloaded}.jpg"
-                            urlretrieve(url, filename)
+                            call_with_retry(IMAGE_LIMITER, urlretrieve, url, filename)
+                            with open(filename, 'rb') as f:
+                                digest = hashlib.sha256(f.read()).hexdigest()
+                            # 沒有 manifest，重跑時同一張照片的編號可能不同，雜湊以照片 id 記錄
+                            if not index.claim_hash(digest, f"{searchword}/{photo['id']}"):
+                                os.remove(filename)
+                                duplicates += 1
+                                continue
                             photos_downloaded += 1
                             pbar.update(1)
                     except Exception as e:
@@ -54,11 +75,15 @@ def download_images(searchword, limitnum=50):
                 break
 
     print(f"Downloaded {photos_downloaded} images for {searchword}")
+    print(f"Skipped {duplicates} duplicate photos for {searchword}")
 
 
 if __name__ == '__main__':
     with open('TW_Attractions_List.json', 'r', encoding='utf-8') as file:
         attractions = json.load(file)
 
+    index = PhotoIndex('/media/Pluto/stanley_hsu/TW_attraction/images/photo_index.json')
+    flickr = create_client()
     for attraction in attractions['TW_Attractions']:
-        download_images(attraction)
+        download_images(attraction, index=index, flickr=flickr)
+        index.save()
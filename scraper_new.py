@@ -1,71 +1,191 @@
 import flickrapi
-from urllib.request import urlretrieve
 import os
 import json
+from itertools import islice
 from tqdm import tqdm
 from dotenv import load_dotenv
+from download_engine import ImageDownloader, DownloadJob, SkippedDownload
+from download_manifest import LandmarkManifest
+from photo_index import PhotoIndex
+from search_cache import SearchCache, FlickrSearcher
+from derivatives import DEFAULT_DERIVATIVES, write_derivatives
+import rate_limit
 
 load_dotenv()
 
 KEY = os.getenv('FLICKER_API_KEY')
 SECRET = os.getenv('FLICKER_API_SECRET')
 
-
-def download_images(category, searchword, limitnum=50):
-    flickr = flickrapi.FlickrAPI(
-        api_key=KEY, secret=SECRET, format='parsed-json')
-    
-    if os.path.exists(f'/media/Pluto/stanley_hsu/TW_attraction/images/{category}/{searchword}'):
+IMAGE_ROOT = '/media/Pluto/stanley_hsu/TW_attraction/images'
+MANIFEST_DIR = '_manifests'
+
+
+def create_searcher(root=IMAGE_ROOT):
+    cache = SearchCache(os.path.join(root, MANIFEST_DIR, 'search_cache'))
+    return FlickrSearcher(KEY, SECRET, cache)
+
+
+def iter_photos(searcher, searchword, page=1, offset=0):
+    """Yield (photo, (page, offset)) for search results, where the cursor points past the photo."""
+    while True:
+        photos = searcher.search(
+            text=searchword, extras='url_c', per_page=500, page=page, sort='relevance')
+
+        if not photos['photos']['photo']:
+            print(f"No more photos found for {searchword}")
+            return
+
+        for i, photo in enumerate(photos['photos']['photo'][offset:], start=offset):
+            url = photo.get('url_c')
+            if url:
+                yield {'id': photo['id'], 'url': url}, (page, i + 1)
+
+        page += 1
+        offset = 0
+
+
+def iter_candidates(searcher, searchword, manifest, free_slots, index, owner, skipped):
+    # 先重試上次沒下載完成的照片，再從上次的搜尋位置繼續
+    for photo in manifest.retry_candidates(free_slots):
+        yield photo, None
+    for photo, cursor in iter_photos(searcher, searchword, manifest.page, manifest.offset):
+        # 其他景點已下載過的照片直接略過
+        if index.claim_id(photo['id'], owner):
+            yield photo, cursor
+        else:
+            skipped['photo_id'] += 1
+
+
+def backfill_derivatives(manifest, landmark_dir, root, specs):
+    """Create missing derivatives for photos downloaded before they were configured."""
+    for n, entry in manifest.photos.items():
+        missing = [spec for spec in specs if spec.name not in entry.get('derivatives', {})]
+        if not missing or not manifest.is_complete(n, landmark_dir):
+            continue
+        path = os.path.join(landmark_dir, manifest.filename(n))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            entry.setdefault('derivatives', {}).update(
+                write_derivatives(data, root, os.path.relpath(path, root), missing))
+        except Exception as e:
+            print(f"Error creating derivatives for {path}: {e}")
+
+
+def download_images(category, searchword, limitnum=50, downloader=None, root=IMAGE_ROOT, index=None,
+                    searcher=None, derivatives=DEFAULT_DERIVATIVES):
+    if searcher is None:
+        searcher = create_searcher(root)
+
+    landmark_dir = os.path.join(root, category, searchword)
+    os.makedirs(landmark_dir, exist_ok=True)
+
+    manifest = LandmarkManifest(
+        os.path.join(root, MANIFEST_DIR, category, f"{searchword}.json"), searchword)
+    manifest.adopt_existing(landmark_dir)
+    if derivatives:
+        backfill_derivatives(manifest, landmark_dir, root, derivatives)
+
+    own_index = index is None
+    if own_index:
+        index = PhotoIndex(os.path.join(root, MANIFEST_DIR, 'photo_index.json'))
+
+    owner = f"{category}/{searchword}"
+    for n, entry in manifest.photos.items():
+        if manifest.is_complete(n, landmark_dir):
+            index.claim_id(entry['id'], owner)
+            if entry.get('sha256'):
+                index.claim_hash(entry['sha256'], f"{owner}/{manifest.filename(n)}")
+
+    free_slots = [n for n in range(limitnum) if not manifest.is_complete(n, landmark_dir)]
+    if not free_slots:
         print(f"Images for {searchword} already exist")
+        manifest.save()
+        if own_index:
+            index.save()
         return
 
-    os.makedirs(f'/media/Pluto/stanley_hsu/TW_attraction/images/{category}/{searchword}', exist_ok=True)
-
-    page = 1
-    photos_downloaded = 0
-
-    with tqdm(total=limitnum, desc=f"Downloading {searchword} images") as pbar:
-        while photos_downloaded < limitnum:
-            try:
-                photos = flickr.photos.search(
-                    text=searchword, extras='url_c', per_page=500, page=page, sort='relevance')
-
-                if not photos['photos']['photo']:
-                    print(f"No more photos found for {searchword}")
-                    break
+    own_downloader = downloader is None
+    if own_downloader:
+        downloader = ImageDownloader()
 
-                for photo in photos['photos']['photo']:
-                    if photos_downloaded >= limitnum:
-                        break
+    def accept(job, digest):
+        return index.claim_hash(digest, os.path.relpath(job.path, root).replace(os.sep, '/'))
 
-                    try:
-                        url = photo.get('url_c')
-                        if url:
-                            filename = f"/media/Pluto/stanley_hsu/TW_attraction/images/{category}/{searchword}/{searchword}-{photos_downloaded}.jpg"
-                            urlretrieve(url, filename)
-                            photos_downloaded += 1
-                            pbar.update(1)
-                    except Exception as e:
-                        print(f"Error downloading image: {e}")
+    def on_saved(job, data):
+        return write_derivatives(data, root, os.path.relpath(job.path, root), derivatives)
 
-                page += 1
+    skipped = {'photo_id': 0, 'content': 0}
+    candidates = iter_candidates(searcher, searchword, manifest, free_slots, index, owner, skipped)
 
-            except flickrapi.exceptions.FlickrError as e:
-                print(f"Flickr API error: {e}")
-                break
-            except Exception as e:
-                print(f"Unexpected error: {e}")
-                break
+    try:
+        with tqdm(total=limitnum, initial=limitnum - len(free_slots),
+                  desc=f"Downloading {searchword} images") as pbar:
+            # 每輪補滿剩餘的檔名編號，失敗的編號留給下一批候選照片
+            while free_slots:
+                batch = list(zip(free_slots, islice(candidates, len(free_slots))))
+                if not batch:
+                    break
 
-    print(f"Downloaded {photos_downloaded} images for {searchword}")
+                for n, (photo, cursor) in batch:
+                    manifest.mark(n, photo, 'pending')
+                    if cursor:
+                        manifest.page, manifest.offset = cursor
+                manifest.save()
+
+                jobs = [
+                    DownloadJob(photo['url'], os.path.join(landmark_dir, manifest.filename(n)))
+                    for n, (photo, _) in batch
+                ]
+                results = downloader.download(jobs, pbar=pbar, accept=accept, on_saved=on_saved)
+
+                for (n, (photo, _)), result in zip(batch, results):
+                    if result.ok:
+                        status = 'done'
+                    elif isinstance(result.error, SkippedDownload):
+                        status = 'duplicate'
+                        skipped['content'] += 1
+                    else:
+                        status = 'failed'
+                    manifest.mark(n, photo, status, result.size, result.sha256, result.extra)
+                manifest.save()
+
+                done = {n for (n, _), result in zip(batch, results) if result.ok}
+                free_slots = [n for n in free_slots if n not in done]
+
+    except flickrapi.exceptions.FlickrError as e:
+        print(f"Flickr API error: {e}")
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+    finally:
+        for key, count in skipped.items():
+            manifest.duplicates[key] += count
+        manifest.save()
+        if own_index:
+            index.save()
+        if own_downloader:
+            downloader.close()
+
+    print(f"Downloaded {limitnum - len(free_slots)} images for {searchword}")
+    print(f"Skipped {skipped['photo_id'] + skipped['content']} duplicate photos for {searchword} "
+          f"({skipped['photo_id']} by photo id, {skipped['content']} by content)")
 
 
 if __name__ == '__main__':
     with open('TW_List.json', 'r', encoding='utf-8') as file:
         attractions = json.load(file)
 
-    for attraction in attractions['TW_Attractions']:
-        download_images('TW_Attractions', attraction)
-    
-    for attraction in attractions['TW_Foods']:
-        download_images('TW_Foods', attraction)
+    index = PhotoIndex(os.path.join(IMAGE_ROOT, MANIFEST_DIR, 'photo_index.json'))
+    searcher = create_searcher()
+
+    with ImageDownloader() as downloader:
+        for attraction in attractions['TW_Attractions']:
+            download_images('TW_Attractions', attraction, downloader=downloader, index=index, searcher=searcher)
+            index.save()
+
+        for attraction in attractions['TW_Foods']:
+            download_images('TW_Foods', attraction, downloader=downloader, index=index, searcher=searcher)
+            index.save()
+
+    print(f"Flickr searches: {searcher.api_calls} API calls, {searcher.cache_hits} served from cache")
+    print(rate_limit.report())
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import hashlib
+import flickrapi
+from download_engine import atomic_write
+from rate_limit import API_LIMITER, call_with_retry
+
+
+class CacheMiss(KeyError):
+    """Raised by an offline cache when a search page has not been recorded."""
+
+
+class SearchCache:
+    """On-disk cache of Flickr ``photos.search`` result pages.
+
+    Each page is stored as ``{cache_dir}/{sha1}.json`` keyed by the search
+    parameters (text, sort, page, extras, per_page). ``ttl`` is in seconds,
+    ``None`` never expires. With ``offline=True`` a miss raises ``CacheMiss``
+    instead of going to the API, so a fixture directory can stand in for Flickr.
+    """
+
+    def __init__(self, cache_dir: str, ttl: float = 7 * 24 * 3600, offline: bool = False):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+
+    def _path(self, params: dict) -> str:
+        key = hashlib.sha1(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, params: dict):
+        path = self._path(params)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        if self.ttl is not None and not self.offline and time.time() - entry['fetched_at'] > self.ttl:
+            return None
+        return entry['result']
+
+    def put(self, params: dict, result):
+        entry = {'params': params, 'fetched_at': time.time(), 'result': result}
+        atomic_write(self._path(params), json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+
+
+class FlickrSearcher:
+    """Single Flickr API client for a whole run, with pages served from a ``SearchCache``.
+
+    The client is only created on the first cache miss, so a fully cached run
+    never talks to Flickr.
+    """
+
+    def __init__(self, api_key: str, secret: str, cache: SearchCache = None, limiter=API_LIMITER):
+        self.api_key = api_key
+        self.secret = secret
+        self.cache = cache
+        self.limiter = limiter
+        self._client = None
+        self.api_calls = 0
+        self.cache_hits = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = flickrapi.FlickrAPI(
+                api_key=self.api_key, secret=self.secret, format='parsed-json')
+        return self._client
+
+    def search(self, text: str, page: int = 1, extras: str = 'url_c', sort: str = 'relevance', per_page: int = 500):
+        params = {'text': text, 'page': page, 'extras': extras, 'sort': sort, 'per_page': per_page}
+
+        if self.cache is not None:
+            result = self.cache.get(params)
+            if result is not None:
+                self.cache_hits += 1
+                return result
+            if self.cache.offline:
+                raise CacheMiss(f"No cached search page for {params}")
+
+        result = call_with_retry(self.limiter, self.client.photos.search, **params)
+        self.api_calls += 1
+
+        if self.cache is not None:
+            self.cache.put(params, result)
+        return result
@@ -0,0 +1,87 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+LEDGER_FILENAME = '_usage_ledger.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    model TEXT NOT NULL,
+    landmark TEXT,
+    image TEXT,
+    kind TEXT,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    latency REAL,
+    batch INTEGER NOT NULL DEFAULT 0,
+    replayed INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+def usage_counts(usage) -> Dict[str, int]:
+    """Prompt, completion and cached tokens of an API ``usage`` (response object or Batch API dict)."""
+    if hasattr(usage, 'model_dump'):
+        usage = usage.model_dump()
+    details = usage.get('prompt_tokens_details') or {}
+    return {
+        'prompt_tokens': usage.get('prompt_tokens') or 0,
+        'completion_tokens': usage.get('completion_tokens') or 0,
+        'cached_tokens': details.get('cached_tokens') or 0
+    }
+
+
+class UsageLedger:
+    """
+    Append-only SQLite table of the API-reported usage of every chat-completions request.
+
+    One row per request: model, landmark, image, kind (``description`` or the
+    conversation type), prompt/completion/cached tokens, latency in seconds and whether
+    it went through the Batch API or was replayed from the response cache (replayed
+    rows were not billed by this run).
+    """
+
+    def __init__(self, dataset_dir: str, path: Optional[str] = None):
+        self.path = path or os.path.join(dataset_dir, LEDGER_FILENAME)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+    def record(self, model: str, usage, image_path: str = '', kind: str = '', latency: Optional[float] = None,
+               batch: bool = False, replayed: bool = False):
+        """Append the usage of one request; ``image_path`` is ``{base_folder}/{landmark}/{image}``."""
+        if usage is None:
+            return
+        counts = usage_counts(usage)
+        with self._lock:
+            self.connection.execute(
+                "INSERT INTO usage (time, model, landmark, image, kind, prompt_tokens, completion_tokens,"
+                " cached_tokens, latency, batch, replayed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), model, os.path.basename(os.path.dirname(image_path)), os.path.basename(image_path),
+                 kind, counts['prompt_tokens'], counts['completion_tokens'], counts['cached_tokens'], latency,
+                 int(batch), int(replayed)))
+            self.connection.commit()
+
+    def totals(self, group_by: List[str]) -> List[sqlite3.Row]:
+        """Requests, token sums and mean latency grouped by the given columns."""
+        columns = ', '.join(group_by)
+        self.connection.row_factory = sqlite3.Row
+        return self.connection.execute(
+            f"SELECT {columns}, COUNT(*) AS requests, SUM(prompt_tokens) AS prompt_tokens,"
+            f" SUM(completion_tokens) AS completion_tokens, SUM(cached_tokens) AS cached_tokens,"
+            f" AVG(latency) AS latency FROM usage GROUP BY {columns} ORDER BY {columns}"
+        ).fetchall()
+
+    def images(self) -> Set[Tuple[str, str]]:
+        """(landmark, image) of every image with at least one row."""
+        return {tuple(row) for row in self.connection.execute("SELECT DISTINCT landmark, image FROM usage")}
+
+    def close(self):
+        self.connection.close()
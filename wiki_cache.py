@@ -0,0 +1,128 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Optional, Tuple
+import wikipedia
+from tqdm import tqdm
+from download_engine import atomic_write
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wiki_cache')
+
+
+class WikiCache:
+    """Compressed on-disk corpus of Wikipedia pages keyed by landmark name.
+
+    Each page is stored as ``{cache_dir}/{lang}/{sha1(name)}.json.gz`` holding the
+    name, the page content and ``fetched_at``. ``ttl`` is in seconds, ``None`` never
+    expires. Failed lookups are recorded as well and only retried after
+    ``error_ttl``, so a missing page does not cost a request on every run. With
+    ``offline=True`` nothing is fetched and a miss yields an empty content.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, lang: str = 'zh-tw', ttl: Optional[float] = None,
+                 error_ttl: float = 24 * 3600, offline: bool = False):
+        self.cache_dir = cache_dir
+        self.lang = lang
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.offline = offline
+        self._lang_lock = threading.Lock()
+        self._lang_set = False
+        self.fetches = 0
+        self.cache_hits = 0
+
+    def _path(self, name: str) -> str:
+        key = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, self.lang, f"{key}.json.gz")
+
+    def get(self, name: str) -> Optional[dict]:
+        """Return the cached entry of ``name`` unless it is missing or stale."""
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            entry = json.load(f)
+        if not self.offline:
+            ttl = self.error_ttl if entry.get('error') else self.ttl
+            if ttl is not None and time.time() - entry['fetched_at'] > ttl:
+                return None
+        return entry
+
+    def put(self, name: str, content: str, error: Optional[str] = None):
+        entry = {'name': name, 'lang': self.lang, 'fetched_at': time.time(), 'content': content, 'error': error}
+        atomic_write(self._path(name), gzip.compress(json.dumps(entry, ensure_ascii=False).encode('utf-8')))
+
+    def fetch(self, name: str) -> dict:
+        """Fetch ``name`` from Wikipedia and store it, recording the error on failure."""
+        with self._lang_lock:
+            # set_lang 會清除 wikipedia 套件的快取，只在第一次請求前設定
+            if not self._lang_set:
+                wikipedia.set_lang(self.lang)
+                self._lang_set = True
+        try:
+            content, error = wikipedia.page(name).content, None
+        except Exception as e:
+            content, error = "", str(e)
+        self.fetches += 1
+        self.put(name, content, error)
+        return {'name': name, 'content': content, 'error': error}
+
+    def entry(self, name: str) -> dict:
+        entry = self.get(name)
+        if entry is not None:
+            self.cache_hits += 1
+            return entry
+        if self.offline:
+            return {'name': name, 'content': "", 'error': 'not in the offline wiki cache'}
+        return self.fetch(name)
+
+    def content(self, name: str) -> str:
+        """Page content of ``name`` ("" when the page could not be fetched)."""
+        return self.entry(name)['content']
+
+    def prefetch(self, names: Iterable[str], workers: int = 8, refresh: bool = False) -> Tuple[int, int, int]:
+        """Fetch every name that is not cached yet (all of them with ``refresh``) concurrently.
+
+        Returns ``(fetched, already cached, failed)``.
+        """
+        names = list(dict.fromkeys(names))
+        todo = names if refresh else [name for name in names if self.get(name) is None]
+        failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.fetch, name): name for name in todo}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Prefetching Wikipedia pages"):
+                entry = future.result()
+                if entry['error']:
+                    failed += 1
+                    logging.error(f"Error fetching Wikipedia content for {entry['name']}: {entry['error']}")
+        return len(todo), len(names) - len(todo), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prefetch Wikipedia pages of the landmark list into the wiki cache.')
+    parser.add_argument('--list', type=str, default='TW_List.json', help='Landmark list (category -> names)')
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--lang', type=str, default='zh-tw')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--refresh', action='store_true', help='Fetch every page again')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with open(args.list, 'r', encoding='utf-8') as f:
+        landmark_list = json.load(f)
+    names = [name for category_names in landmark_list.values() for name in category_names]
+
+    cache = WikiCache(args.cache_dir, lang=args.lang)
+    fetched, cached, failed = cache.prefetch(names, workers=args.workers, refresh=args.refresh)
+    print(f"Wiki cache {args.cache_dir}: fetched {fetched} pages ({failed} failed), {cached} already cached")
+
+
+if __name__ == "__main__":
+    main()
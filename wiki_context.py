@@ -0,0 +1,135 @@
+import math
+import regex
+from collections import Counter
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_MAX_TOKENS = 2000
+PASSAGE_CHARS = 400
+PASSAGE_SEPARATOR = "\n\n"
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+CJK_RUN = regex.compile(r'[\p{Han}\p{Hiragana}\p{Katakana}]+')
+WORD = regex.compile(r'[\p{L}\p{N}]+')
+HEADING = regex.compile(r'^=+\s*(.*?)\s*=+$')
+SENTENCE_END = regex.compile(r'(?<=[。！？；!?])')
+
+
+def terms(text: str) -> List[str]:
+    """Lexical terms of a text: character bigrams of CJK runs and lowercased words otherwise."""
+    result = []
+    for run in CJK_RUN.findall(text):
+        result.extend(run[i:i + 2] for i in range(max(1, len(run) - 1)))
+    result.extend(word.lower() for word in WORD.findall(CJK_RUN.sub(' ', text)))
+    return result
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_CHARS) -> List[str]:
+    """
+    Split a Wikipedia article into passages of about ``max_chars`` characters.
+
+    Paragraphs are kept whole when they fit, consecutive short paragraphs are merged,
+    long ones are cut at sentence ends, and every passage is prefixed with the title
+    of its section.
+    """
+    passages = []
+    section = ""
+    current = ""
+
+    def flush():
+        nonlocal current
+        if current.strip():
+            passages.append(f"{section}：{current.strip()}" if section else current.strip())
+        current = ""
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        heading = HEADING.match(line)
+        if heading:
+            flush()
+            section = heading.group(1)
+            continue
+        # 過長的段落依句尾切開，句子之間不加換行
+        pieces = [line] if len(line) <= max_chars else [s for s in SENTENCE_END.split(line) if s]
+        for i, piece in enumerate(pieces):
+            if current and len(current) + len(piece) > max_chars:
+                flush()
+            current += "\n" + piece if current and i == 0 else piece
+    flush()
+    return passages
+
+
+def bm25_scores(passages: List[str], query: str, k1: float = BM25_K1, b: float = BM25_B) -> List[float]:
+    """BM25 score of every passage for the terms of ``query``."""
+    documents = [Counter(terms(passage)) for passage in passages]
+    if not documents:
+        return []
+    lengths = [sum(document.values()) for document in documents]
+    average_length = sum(lengths) / len(lengths) or 1
+    document_frequency = Counter(term for document in documents for term in document)
+    query_terms = Counter(terms(query))
+
+    scores = []
+    for document, length in zip(documents, lengths):
+        score = 0.0
+        for term, query_count in query_terms.items():
+            frequency = document.get(term)
+            if not frequency:
+                continue
+            idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += query_count * idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+        scores.append(score)
+    return scores
+
+
+class WikiContextBuilder:
+    """Select the passages of a Wikipedia article most relevant to an image description.
+
+    Passages are ranked by BM25 against the description and packed, best first, until
+    ``max_tokens`` (counted with ``count_tokens``) is reached; the lead passage is
+    always tried first. The kept passages are returned in article order. An article
+    that already fits the budget is returned unchanged, which also keeps it identical
+    for every image of the landmark. ``max_tokens=None`` disables the selection.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], max_tokens: Optional[int] = DEFAULT_MAX_TOKENS,
+                 passage_chars: int = PASSAGE_CHARS):
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.passage_chars = passage_chars
+        # 同一景點的每張圖片都使用同一篇文章，切分與 token 計數只做一次
+        self._prepare = lru_cache(maxsize=32)(self._split_and_count)
+
+    def _split_and_count(self, article: str) -> Tuple[int, List[str], List[int]]:
+        passages = split_passages(article, self.passage_chars)
+        return self.count_tokens(article), passages, [self.count_tokens(passage) for passage in passages]
+
+    def build(self, article: str, query: str) -> Tuple[str, Dict]:
+        """Return the context for ``query`` and ``{'wiki_tokens', 'wiki_context_tokens'}``."""
+        if not article:
+            return article, {'wiki_tokens': 0, 'wiki_context_tokens': 0}
+        article_tokens, passages, passage_tokens = self._prepare(article)
+        if self.max_tokens is None or article_tokens <= self.max_tokens:
+            return article, {'wiki_tokens': article_tokens, 'wiki_context_tokens': article_tokens}
+
+        scores = bm25_scores(passages, query)
+        order = [0] + sorted(range(1, len(passages)), key=lambda i: -scores[i])
+        separator_tokens = self.count_tokens(PASSAGE_SEPARATOR)
+        selected = []
+        used = 0
+        for i in order:
+            cost = passage_tokens[i] + (separator_tokens if selected else 0)
+            if used + cost <= self.max_tokens:
+                selected.append(i)
+                used += cost
+        # 分隔符號可能與段落首尾合併成不同的 token，以實際計數為準，超出時移除排名最低的段落
+        while True:
+            context = PASSAGE_SEPARATOR.join(passages[i] for i in sorted(selected))
+            context_tokens = self.count_tokens(context)
+            if context_tokens <= self.max_tokens or not selected:
+                break
+            selected.pop()
+        return context, {'wiki_tokens': article_tokens, 'wiki_context_tokens': context_tokens}